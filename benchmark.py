@@ -0,0 +1,576 @@
+import argparse
+import heapq
+import multiprocessing
+import time
+import tracemalloc
+
+import numpy as np
+
+from occupancy import ADJACENT_OFFSETS, LRUCache, OccupancyIndex, VoxelOccupancyCache
+from planning import findPath, AnytimePlanner
+from blazes import findBlaze
+from splines import CubicSpline
+from mock_client import MockWorld, MockMultirotorClient
+
+parser = argparse.ArgumentParser(description='Benchmark the simulator independent parts of the flight stack')
+parser.add_argument('benchmarks', type=str, nargs='*', default=None, help='Benchmarks to run (default: all)')
+parser.add_argument('--repeats',     type=int,   default=5,      help='Number of timed repetitions of each benchmark')
+parser.add_argument('--voxel_size',  type=float, default=1.0,    help='The size of voxels in the occupancy map cache')
+parser.add_argument('--cache_size',  type=int,   default=4096,   help='The number of voxel chunks in the local occupancy cache')
+parser.add_argument('--chunk_size',  type=int,   default=16,     help='The side length in voxels of each occupancy cache chunk')
+parser.add_argument('--n_points',    type=int,   default=20000,  help='Number of points in each synthetic lidar scan')
+parser.add_argument('--endpoint_tolerance', type=float, default=10.0, help='The distance tolerance on reaching the endpoint marker')
+parser.add_argument('--far_task_radius',    type=float, default=50.0, help='The max distance of endpoints in the far planning task')
+parser.add_argument('--n_tasks',     type=int,   default=3,      help='Number of planning tasks to time')
+parser.add_argument('--control_period', type=float, default=0.7,  help='Control period the anytime planner budget is a fraction of')
+parser.add_argument('--planning_budget', type=float, default=0.5, help='Fraction of the control period the anytime planner may spend each tick')
+parser.add_argument('--anytime_expansions', type=int, default=300, help='Expansion budget per tick of the anytime planner, so it takes several ticks to converge')
+parser.add_argument('--n_blazes',    type=int,   default=3,      help='Number of blazes to search for in the hiking blaze benchmark')
+parser.add_argument('--min_blaze_gap', type=float, default=10.0, help='The minimum distance between hiking task blazes')
+parser.add_argument('--n_knots',     type=int,   default=4000,   help='Number of knots in the spline fitting benchmark')
+parser.add_argument('--model_name',  type=str,   default='lstm', help='Flight model architecture for the models, inference and vehicles benchmarks')
+parser.add_argument('--model_weights', type=str,  default=None,   help='Optional weights for the inference benchmark model')
+parser.add_argument('--seq_len',     type=int,   default=64,     help='Sliding window length of the flight model')
+parser.add_argument('--rnn_size',    type=int,   default=32,     help='Size of the flight model recurrent layer')
+parser.add_argument('--ticks',       type=int,   default=200,    help='Number of control ticks to time in the inference benchmark')
+parser.add_argument('--vehicles',    type=int,   nargs='*', default=[1, 4, 8, 16], help='Numbers of mock vehicles to fly together in the vehicles benchmark')
+parser.add_argument('--inference_backend', type=str, default='tflite', help='Runtime for the flight model in the vehicles benchmark')
+parser.add_argument('--seed',        type=int,   default=0)
+
+# the defaults when imported for the helpers below, the command line when run
+args = parser.parse_args([])
+rng  = np.random.default_rng(args.seed)
+
+# Utilities
+
+def timeit(f, repeats=None):
+    '''
+    Returns the best wall clock time of repeats calls to f, --repeats by default
+    '''
+    best = float('inf')
+    for _ in range(repeats or args.repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def syntheticLidarScan(nPoints, radius=30, nTrees=40):
+    '''
+    A forest-like scan: points on the trunks of vertical cylindrical trees plus the ground
+    '''
+    trunks   = rng.uniform(-radius, radius, size=(nTrees, 2))
+    nTrunk   = nPoints * 3 // 4
+    tree     = rng.integers(nTrees, size=nTrunk)
+    angle    = rng.uniform(0, 2*np.pi, size=nTrunk)
+    trunkPts = np.stack([
+        trunks[tree, 0] + 0.5*np.cos(angle),
+        trunks[tree, 1] + 0.5*np.sin(angle),
+        rng.uniform(-20, 0, size=nTrunk),
+    ], axis=1)
+
+    groundPts = np.concatenate([rng.uniform(-radius, radius, size=(nPoints - nTrunk, 2)), np.zeros((nPoints - nTrunk, 1))], axis=1)
+
+    return np.concatenate([trunkPts, groundPts]).astype(np.float32)
+
+
+def pathCost(path):
+    return np.sum(np.linalg.norm(np.diff(np.array(path), axis=0), axis=1))
+
+# Benchmarks
+
+class TupleOccupancyBaseline:
+    '''
+    The original occupancy map: one tuple of floats per voxel in an LRUCache
+    '''
+    def __init__(self, voxelSize, capacity):
+        self.voxelSize = voxelSize
+        self.cache     = LRUCache(capacity)
+
+    def point2Voxel(self, point):
+        return tuple(self.voxelSize * int(round(v / self.voxelSize)) for v in point)
+
+    def addPoint(self, point):
+        voxel = self.point2Voxel(point)
+        for dx, dy, dz in (self.voxelSize * ADJACENT_OFFSETS).tolist():
+            self.cache.add((voxel[0] + dx, voxel[1] + dy, voxel[2] + dz))
+
+    def __contains__(self, point):
+        return self.point2Voxel(point) in self.cache
+
+
+def allocatedBytes(f):
+    f() # warm up so one-off allocations inside numpy aren't counted
+
+    tracemalloc.start()
+    result = f()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def benchmarkOccupancy():
+    scan    = syntheticLidarScan(args.n_points)
+    queries = syntheticLidarScan(args.n_points) + rng.uniform(-2, 2, size=(args.n_points, 3))
+
+    def baseline():
+        occupancyMap = TupleOccupancyBaseline(args.voxel_size, float('inf'))
+        for p in scan:
+            occupancyMap.addPoint(p)
+        return occupancyMap
+
+    def chunked():
+        occupancyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size, chunkSize=args.chunk_size)
+        occupancyMap.addPoints(scan)
+        return occupancyMap
+
+    baselineBytes, baselineMap = allocatedBytes(baseline)
+    chunkedBytes,  chunkedMap  = allocatedBytes(chunked)
+
+    # the maps only agree until the chunked map starts evicting
+    queryList = queries.tolist()
+    if len(chunkedMap.chunks) < args.cache_size:
+        expected = {baselineMap.point2Voxel(v) for v in baselineMap.cache.keys()}
+        if expected != set(map(tuple, chunkedMap.occupiedVoxels().tolist())):
+            raise Exception('Chunked occupancy map disagrees with the tuple-keyed map')
+
+        if [p in baselineMap for p in queryList] != [p in chunkedMap for p in queryList]:
+            raise Exception('Chunked occupancy lookups disagree with the tuple-keyed map')
+
+    if [p in chunkedMap for p in queryList] != chunkedMap.containsPoints(queries).tolist():
+        raise Exception('Bulk occupancy lookups disagree with single lookups')
+
+    baselineTime = timeit(baseline)
+    chunkedTime  = timeit(chunked)
+
+    baselineLookupTime = timeit(lambda: [p in baselineMap for p in queryList])
+    chunkedLookupTime  = timeit(lambda: [p in chunkedMap for p in queryList])
+    bulkLookupTime     = timeit(lambda: chunkedMap.containsPoints(queries))
+
+    nVoxels = len(chunkedMap)
+    print(f'occupancy: {len(scan)} points -> {nVoxels} voxels in {len(chunkedMap.chunks)} chunks')
+    print(f'  tuple addPoint loop: {len(scan) / baselineTime:12.0f} points/sec {baselineBytes / nVoxels:8.1f} bytes/voxel {len(queries) / baselineLookupTime:10.0f} lookups/sec')
+    print(f'  chunked addPoints:   {len(scan) / chunkedTime:12.0f} points/sec {chunkedBytes / nVoxels:8.1f} bytes/voxel {len(queries) / chunkedLookupTime:10.0f} lookups/sec')
+    print(f'  chunked containsPoints: {len(queries) / bulkLookupTime:9.0f} lookups/sec')
+
+
+def baselineFindPath(startpoint, endpoint, occupancyMap, stats, repairHeap=False):
+    '''
+    The original A*: numpy heuristics, list removal from the heap and no closed set.
+    repairHeap restores the heap invariant after each removal, which the original doesn't.
+    '''
+    def euclidean(voxel1, voxel2):
+        return np.linalg.norm(np.array(voxel2) - np.array(voxel1))
+
+    def h(voxel1, voxel2):
+        return 100*euclidean(voxel1, voxel2)
+
+    start = occupancyMap.point2Voxel(startpoint)
+    end   = occupancyMap.point2Voxel(endpoint)
+
+    cameFrom = dict()
+    gScore   = {start: 0}
+    fScore   = {start: h(start, endpoint)}
+    openSet  = [(fScore[start], start)]
+
+    while openSet:
+        current = heapq.heappop(openSet)[1]
+        stats['expansions'] += 1
+
+        if current == end:
+            path = [current]
+            while path[-1] != start:
+                current = cameFrom[current]
+                path.append(current)
+            return list(reversed(path))
+
+        for neighbor in occupancyMap.getNextSteps(current, end):
+            tentativeGScore = gScore.get(current, float("inf")) + euclidean(current, neighbor)
+
+            if tentativeGScore < gScore.get(neighbor, float('inf')):
+                cameFrom[neighbor] = current
+                gScore[neighbor]   = tentativeGScore
+
+                if neighbor in fScore:
+                    try:
+                        openSet.remove((fScore[neighbor], neighbor))
+                        if repairHeap:
+                            heapq.heapify(openSet)
+                    except:
+                        pass
+                fScore[neighbor] = gScore.get(neighbor, float('inf')) + h(neighbor, endpoint)
+
+                heapq.heappush(openSet, (fScore[neighbor], neighbor))
+
+    raise ValueError("Couldn't find a path")
+
+
+def forestTasks(occupancyMap, radius, nTasks):
+    '''
+    Random start and end points radius apart in free space
+    '''
+    tasks = []
+    while len(tasks) < nTasks:
+        start   = np.array([*rng.uniform(-5, 5, size=2), -10.0])
+        heading = rng.uniform(0, 2*np.pi)
+        end     = start + radius * np.array([np.cos(heading), np.sin(heading), 0.0])
+        if start not in occupancyMap and end not in occupancyMap:
+            tasks.append((start, end))
+    return tasks
+
+
+def benchmarkPlanning():
+    occupancyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size, endpointTolerance=args.endpoint_tolerance, chunkSize=args.chunk_size)
+    occupancyMap.addPoints(syntheticLidarScan(4 * args.n_points, radius=args.far_task_radius + 10, nTrees=160))
+
+    for start, end in forestTasks(occupancyMap, args.far_task_radius, args.n_tasks):
+        baselineStats = {'expansions': 0}
+        stats         = dict()
+
+        baselinePath = baselineFindPath(start, end, occupancyMap, baselineStats)
+        path         = findPath(start, end, occupancyMap, stats=stats)
+
+        baselineTime = timeit(lambda: baselineFindPath(start, end, occupancyMap, {'expansions': 0}))
+        pathTime     = timeit(lambda: findPath(start, end, occupancyMap))
+
+        print(f'planning: {len(path)} knots, same path: {path == baselinePath}')
+
+        # list removal breaks the baseline's heap invariant, so it can pop voxels out of f order
+        if path != baselinePath:
+            repairedPath = baselineFindPath(start, end, occupancyMap, {'expansions': 0}, repairHeap=True)
+            print(f'  the baseline popped out of order after list removal broke its heap: path cost {pathCost(baselinePath):.2f} against {pathCost(path):.2f},'
+                  f' with the heap repaired it finds the same path: {repairedPath == path}')
+        print(f'  baseline findPath: {baselineStats["expansions"]:8d} expansions {baselineStats["expansions"] / baselineTime:10.0f} expansions/sec {1000 * baselineTime:8.1f} ms')
+        print(f'  findPath:          {stats["expansions"]:8d} expansions {stats["expansions"] / pathTime:10.0f} expansions/sec {1000 * pathTime:8.1f} ms ({baselineTime / pathTime:.1f}x)')
+
+
+def benchmarkAnytime():
+    # a dense forest, so the search takes several ticks of budget to converge
+    occupancyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size, endpointTolerance=args.endpoint_tolerance, chunkSize=args.chunk_size)
+    occupancyMap.addPoints(syntheticLidarScan(10 * args.n_points, radius=args.far_task_radius + 10, nTrees=400))
+
+    start, end = forestTasks(occupancyMap, args.far_task_radius, 1)[0]
+    planner    = AnytimePlanner(end, occupancyMap)
+    budget     = args.planning_budget * args.control_period
+
+    optimalPath = findPath(start, end, occupancyMap, heuristicWeight=1)
+    print(f'anytime: {args.anytime_expansions} expansions or {1000 * budget:.0f} ms per tick, optimal path cost {pathCost(optimalPath):.1f}')
+
+    tick, obstacles = 0, 0
+    while not planner.converged:
+        startTime = time.perf_counter()
+        path, bound, expansions = planner.plan(start, budget, args.anytime_expansions)
+        tickTime = time.perf_counter() - startTime
+
+        cost = f'{pathCost(path):6.1f}' if path is not None else '  none'
+        print(f'  tick {tick}: {1000 * tickTime:6.1f} ms {expansions:6d} expansions, epsilon {planner.epsilon:.1f}, path cost {cost}, suboptimality bound {bound:.3f}')
+
+        # new obstacles on the path are repaired around, reusing the search
+        if not planner.converged and path is not None and len(path) >= 8 and obstacles < args.n_tasks:
+            occupancyMap.addPoints(np.array(path[5:7]) + rng.uniform(-0.5, 0.5, size=(2, 3)))
+            obstacles += 1
+            print('  new obstacle on the path')
+
+        tick += 1
+
+
+def baselineCheckBand(k, blazes, blazeStart, zLimit, position, occupancyMap, minBlazeGap):
+    '''
+    The original band search: one occupancy, spacing and half space test per voxel
+    '''
+    x = np.array(position)
+    p = np.array(blazeStart)
+    for z in reversed(range(zLimit[0], zLimit[1])):
+        corners  = [(blazeStart[0] - k, blazeStart[1] - k, z), (blazeStart[0] + k, blazeStart[1] - k, z), (blazeStart[0] + k, blazeStart[1] + k, z), (blazeStart[0] - k, blazeStart[1] + k, z)]
+        tangents = [(1, 0, 0), (0, 1, 0), (-1, 0, 0), (0, -1, 0)]
+
+        for corner, tangent in zip(np.array(corners), np.array(tangents)):
+            for i in range(2*k-1):
+                voxel = occupancyMap.point2Voxel(corner + i * tangent)
+
+                isOccupied    = voxel in occupancyMap
+                isSpacedOut   = not np.any([np.linalg.norm(np.array(voxel) - np.array(b)) < minBlazeGap for b in blazes])
+                isInHalfSpace = (np.array(voxel) - x).dot((p - x) / np.linalg.norm(p - x)) > np.linalg.norm(p - x)
+
+                if isOccupied and isSpacedOut and isInHalfSpace:
+                    return voxel
+    return None
+
+
+def baselineBlazeSearch(start, position, occupancyMap, numBlazes):
+    blazes     = []
+    blazeStart = occupancyMap.point2Voxel(start)
+    for _ in range(numBlazes):
+        nextBlaze = None
+        for k in range(5, 50):
+            nextBlaze = baselineCheckBand(k, blazes, blazeStart, (-10, -5), position, occupancyMap, args.min_blaze_gap)
+            if nextBlaze is not None:
+                break
+        if nextBlaze is None:
+            break
+        blazes.append(nextBlaze)
+        blazeStart = nextBlaze
+    return blazes
+
+
+def indexBlazeSearch(start, position, occupancyMap, numBlazes):
+    index      = occupancyMap.spatialIndex()
+    blazes     = []
+    blazeStart = occupancyMap.point2Voxel(start)
+    for _ in range(numBlazes):
+        nextBlaze = findBlaze(index, blazes, blazeStart, (-10, -5), position, args.min_blaze_gap)
+        if nextBlaze is None:
+            break
+        blazes.append(nextBlaze)
+        blazeStart = nextBlaze
+    return blazes
+
+
+def benchmarkBlazes():
+    occupancyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size, chunkSize=args.chunk_size)
+    occupancyMap.addPoints(syntheticLidarScan(4 * args.n_points, radius=60, nTrees=160))
+
+    start    = np.array([0.0, 0.0, -7.0])
+    position = np.array([-3.0, 0.0, -7.0])
+
+    buildTime = timeit(lambda: OccupancyIndex(occupancyMap))
+    scan      = syntheticLidarScan(args.n_points // 10)
+    print(f'blazes: spatial index over {len(occupancyMap)} voxels built in {1000 * buildTime:.1f} ms')
+
+    # blazes in the forest, then a search that finds no tree at all
+    emptyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size, chunkSize=args.chunk_size)
+    for name, searchMap in [('forest', occupancyMap), ('no trees', emptyMap)]:
+        baselineBlazes = baselineBlazeSearch(start, position, searchMap, args.n_blazes)
+        found          = indexBlazeSearch(start, position, searchMap, args.n_blazes)
+
+        baselineTime = timeit(lambda: baselineBlazeSearch(start, position, searchMap, args.n_blazes), repeats=1)
+        searchTime   = timeit(lambda: indexBlazeSearch(start, position, searchMap, args.n_blazes))
+
+        # the band scan skips a voxel on each side of a band so the blazes can differ
+        print(f'  {name}: {len(found)} blazes, same blazes: {found == baselineBlazes}')
+        print(f'    baseline band scan: {1000 * baselineTime:9.1f} ms')
+        print(f'    spatial index:      {1000 * searchTime:9.1f} ms ({baselineTime / searchTime:.1f}x)')
+
+    # keeping the index up to date as scans come in
+    index = occupancyMap.spatialIndex()
+    def addScan():
+        occupancyMap.addPoints(scan + rng.uniform(-60, 60, size=3) * [1, 1, 0])
+        index.update()
+    updateTime = timeit(addScan)
+    print(f'  update after a {len(scan)} point scan: {1000 * updateTime:.1f} ms, {index.rebuilds} rebuilds')
+
+    queries       = rng.uniform(-60, 60, size=(args.n_points, 3))
+    clearanceTime = timeit(lambda: index.clearance(queries))
+    print(f'  clearance: {len(queries) / clearanceTime:.0f} queries/sec')
+
+
+def denseSplineFit(x, y):
+    '''
+    The original natural cubic spline fit: a dense solve and Python loops, one axis at a time
+    '''
+    size    = len(x)
+    delta_x = np.diff(x)
+    delta_y = np.diff(y)
+
+    A = np.zeros(shape = (size,size))
+    k = np.zeros(shape=(size,1))
+    A[0,0] = 1
+    A[-1,-1] = 1
+
+    for i in range(1,size-1):
+        A[i, i-1] = delta_x[i-1]
+        A[i, i+1] = delta_x[i]
+        A[i,i] = 2*(delta_x[i-1]+delta_x[i])
+
+        k[i,0] = 3*(delta_y[i]/delta_x[i] - delta_y[i-1]/delta_x[i-1])
+
+    c = np.linalg.solve(A, k)
+
+    d = np.zeros(shape = (size-1,1))
+    b = np.zeros(shape = (size-1,1))
+    for i in range(0,len(d)):
+        d[i] = (c[i+1] - c[i]) / (3*delta_x[i])
+        b[i] = (delta_y[i]/delta_x[i]) - (delta_x[i]/3)*(2*c[i] + c[i+1])
+
+    return b.squeeze(), c.squeeze(), d.squeeze()
+
+
+def benchmarkSplines():
+    # a long wandering A* style path: unit steps between neighboring voxels
+    steps = rng.integers(-1, 2, size=(args.n_knots, 3))
+    steps[np.all(steps == 0, axis=1), 0] = 1
+    knots = np.cumsum(steps, axis=0).astype(float)
+    t     = np.linspace(0, 1, args.n_knots)
+
+    spline = CubicSpline(t, knots)
+    b, c, d = spline.coeff
+    for axis in range(3):
+        denseB, denseC, denseD = denseSplineFit(t, knots[:, axis])
+        if not (np.allclose(b[:, axis], denseB) and np.allclose(c[:, axis], denseC) and np.allclose(d[:, axis], denseD)):
+            raise Exception('Banded spline fit disagrees with the dense solve')
+
+    try:
+        from scipy.interpolate import CubicSpline as ScipyCubicSpline
+        scipySpline = ScipyCubicSpline(t, knots, bc_type='natural')
+        if not np.allclose(scipySpline.c[2], b) or not np.allclose(scipySpline.c[1], c[:-1]):
+            raise Exception('Banded spline fit disagrees with scipy')
+    except ImportError:
+        pass
+
+    denseTime  = timeit(lambda: [denseSplineFit(t, knots[:, axis]) for axis in range(3)], repeats=1)
+    bandedTime = timeit(lambda: CubicSpline(t, knots))
+
+    print(f'splines: {args.n_knots} knots in 3 dimensions')
+    print(f'  dense solve per axis: {1000 * denseTime:10.2f} ms')
+    print(f'  banded (n,3) solve:   {1000 * bandedTime:10.2f} ms ({denseTime / bandedTime:.0f}x)')
+
+    samples    = np.linspace(0, 1, 1000)
+    scalarTime = timeit(lambda: np.array([spline(ti) for ti in samples]))
+    arrayTime  = timeit(lambda: spline(samples))
+    print(f'  1000 samples one t at a time: {1000 * scalarTime:8.2f} ms')
+    print(f'  1000 samples as one array:    {1000 * arrayTime:8.2f} ms ({scalarTime / arrayTime:.0f}x)')
+
+
+def buildModels(names):
+    '''
+    Builds the named models, or every registered one for None as flight.py
+    used to, after importing tensorflow. Returns the import and build times,
+    the peak resident memory in MB after each and the models that couldn't
+    be built here.
+    '''
+    startTime = time.perf_counter()
+    import tensorflow
+    from models import MODEL_BUILDERS, buildModel, residentMemory
+    importTime, importMemory = time.perf_counter() - startTime, residentMemory()
+
+    startTime = time.perf_counter()
+    skipped   = []
+    if names is None:
+        for (name, multi), builder in MODEL_BUILDERS.items():
+            # node_cell isn't always installed and newer kerasncp lacks LTCCell
+            try:
+                builder(args.seq_len, args.rnn_size, 'rgb')
+            except (ImportError, AttributeError):
+                skipped.append(f'{name}{"-multi" if multi else ""}')
+    else:
+        for name in names:
+            buildModel(name, seqLen=args.seq_len, rnnSize=args.rnn_size)
+
+    return importTime, importMemory, time.perf_counter() - startTime, residentMemory(), skipped
+
+
+def benchmarkModels():
+    # each in a fresh process, so peak memory isn't shared
+    context = multiprocessing.get_context('spawn')
+
+    print(f'models: startup in a fresh process, {args.seq_len} frame window')
+    for label, names in ((args.model_name, [args.model_name]), ('every model', None)):
+        with context.Pool(1) as pool:
+            importTime, importMemory, buildTime, buildMemory, skipped = pool.apply(buildModels, (names,))
+
+        print(f'  {label:12s} tensorflow import {importTime:5.2f} s, peak {importMemory:4.0f} MB; build {buildTime:5.2f} s, peak {buildMemory:4.0f} MB (+{buildMemory - importMemory:3.0f} MB)')
+        if skipped:
+            print(f'    not buildable here, so not counted: {", ".join(skipped)}')
+
+
+def benchmarkInference():
+    from models import buildModel
+    from inference import InferenceBackend, InferenceMode, StreamingModel
+
+    model = buildModel(args.model_name, seqLen=args.seq_len, rnnSize=args.rnn_size)
+    if args.model_weights is not None:
+        model.load_weights(args.model_weights)
+
+    frames = rng.integers(0, 256, size=(args.ticks, *model.input_shape[2:]), dtype=np.uint8)
+
+    configurations = [
+        (InferenceMode.PREDICT,  InferenceBackend.KERAS),
+        (InferenceMode.PREDICT,  InferenceBackend.FUNCTION),
+        (InferenceMode.PREDICT,  InferenceBackend.TFLITE),
+        (InferenceMode.WINDOWED, InferenceBackend.FUNCTION),
+        (InferenceMode.WINDOWED, InferenceBackend.TFLITE),
+        (InferenceMode.STATEFUL, InferenceBackend.FUNCTION),
+        (InferenceMode.STATEFUL, InferenceBackend.TFLITE),
+    ]
+
+    print(f'inference: {args.model_name} over {args.ticks} ticks with a {args.seq_len} frame window')
+    for mode, backend in configurations:
+        # only a missing runtime is expected, anything else is a failure of the code measured
+        try:
+            streamingModel = StreamingModel(model, args.seq_len, mode=mode, backend=backend)
+        except ImportError as e:
+            print(f'  {mode:8s} {backend:8s} unavailable: {e}')
+            continue
+
+        # latency from the first tick, the window fills while timing like it does in flight
+        tickTimes = []
+        for frame in frames:
+            startTime = time.perf_counter()
+            streamingModel.step(frame)
+            tickTimes.append(time.perf_counter() - startTime)
+
+        p50, p99 = 1000 * np.percentile(tickTimes[1:], [50, 99])
+        print(f'  {mode:8s} {backend:8s} p50 {p50:8.2f} ms  p99 {p99:8.2f} ms')
+
+
+def benchmarkVehicles():
+    from models import ChannelOrder, buildModel
+    from inference import InferenceMode, StreamingModel
+
+    model = buildModel(args.model_name, seqLen=args.seq_len, rnnSize=args.rnn_size, channelOrder=ChannelOrder.BGR)
+    if args.model_weights is not None:
+        model.load_weights(args.model_weights)
+
+    def frame(client, name):
+        response = client.simGetImages([None], vehicle_name=name)[0]
+        return np.frombuffer(response.image_data_uint8, dtype=np.uint8).reshape(model.input_shape[2:])
+
+    print(f'vehicles: {args.model_name} {args.inference_backend} over {args.ticks} ticks of capture, inference and command in a mock world')
+    for n in args.vehicles:
+        client = MockMultirotorClient(MockWorld(n))
+        names  = client.listVehicles()
+
+        # one vehicle per process as flight.py did, run back to back, against one batched forward pass
+        singleModels = [StreamingModel(model, args.seq_len, mode=InferenceMode.STATEFUL, backend=args.inference_backend) for _ in names]
+        batchModel   = StreamingModel(model, args.seq_len, mode=InferenceMode.STATEFUL, backend=args.inference_backend, batchSize=n)
+
+        def flySingly():
+            for name, singleModel in zip(names, singleModels):
+                velocity = singleModel.step(frame(client, name))
+                client.moveByVelocityAsync(*map(float, velocity), 0.1, vehicle_name=name)
+
+        def flyBatched():
+            velocities = batchModel.stepBatch(np.stack([frame(client, name) for name in names]))
+            for name, velocity in zip(names, velocities):
+                client.moveByVelocityAsync(*map(float, velocity), 0.1, vehicle_name=name)
+
+        # warm up
+        flySingly()
+        flyBatched()
+        singleTime  = timeit(lambda: [flySingly() for _ in range(args.ticks)], repeats=1)
+        batchedTime = timeit(lambda: [flyBatched() for _ in range(args.ticks)], repeats=1)
+
+        singleRate  = n * args.ticks / singleTime
+        batchedRate = n * args.ticks / batchedTime
+        print(f'  {n:3d} vehicles: one at a time {singleRate:8.1f} frames/s, batched {batchedRate:8.1f} frames/s ({batchedRate / singleRate:.1f}x)')
+
+
+BENCHMARKS = {
+    'occupancy': benchmarkOccupancy,
+    'planning':  benchmarkPlanning,
+    'anytime':   benchmarkAnytime,
+    'blazes':    benchmarkBlazes,
+    'splines':   benchmarkSplines,
+    'models':    benchmarkModels,
+    'inference': benchmarkInference,
+    'vehicles':  benchmarkVehicles,
+}
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    rng  = np.random.default_rng(args.seed)
+
+    for name in args.benchmarks or BENCHMARKS:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Unknown benchmark: {name}')
+        BENCHMARKS[name]()
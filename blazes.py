@@ -0,0 +1,90 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+Blaze search for the hiking task.
+
+Blazes are occupied voxels, i.e. trees, found by searching outwards from
+the previous blaze in square bands of growing radius k, from the top z
+level down and counterclockwise around each band. The first voxel that is
+occupied, at least minBlazeGap from every earlier blaze and ahead of the
+drone wins. Rather than walk the bands voxel by voxel, the occupied voxels
+within a band are fetched in one radius query on the map's spatial index,
+filtered, and the first in band order taken.
+'''
+import numpy as np
+
+
+def inHalfSpace(points, p, x):
+    '''
+    Checks which points are in the half space defined by point p and
+    normal vector (p - x) / ||p - x|| where x is the current position of
+    the drone
+    '''
+    normal = p - x
+    length = np.linalg.norm(normal)
+    return (points - x) @ (normal / length) > length
+
+
+def findBlaze(index, blazes, blazeStart, zLimit, position, minBlazeGap, minSearchDepth=5, maxSearchDepth=50):
+    '''
+    Returns the first blaze in band order around blazeStart, or None if
+    there isn't one within maxSearchDepth
+    '''
+    center  = np.array(blazeStart, dtype=float)
+    zCenter = (zLimit[0] + zLimit[1] - 1) / 2
+    zRadius = (zLimit[1] - 1 - zLimit[0]) / 2
+
+    # the first blaze in band order is in the nearest bands that have one,
+    # so search the cube of bands up to a radius, doubling it until found
+    radius = min(2 * minSearchDepth, maxSearchDepth - 1)
+    while True:
+        blaze = firstBlaze(index, blazes, center, (zCenter, zRadius), radius, position, minBlazeGap, minSearchDepth)
+        if blaze is not None or radius >= maxSearchDepth - 1:
+            return blaze
+        radius = min(2 * radius, maxSearchDepth - 1)
+
+
+def firstBlaze(index, blazes, center, zRange, radius, position, minBlazeGap, minSearchDepth):
+    zCenter, zRadius = zRange
+
+    # the cube the bands up to radius sweep out, in the chebyshev norm
+    voxels = index.withinRadius((center[0], center[1], zCenter), max(radius, zRadius), p=np.inf)
+
+    offsets = voxels[:, :2] - center[:2]
+    band    = np.ceil(np.max(np.abs(offsets), axis=1))
+
+    isValid = (band >= minSearchDepth) & (band <= radius)
+    isValid &= np.abs(voxels[:, 2] - zCenter) <= zRadius
+    isValid &= inHalfSpace(voxels, center, position)
+    if len(blazes) > 0:
+        gaps     = voxels[:, np.newaxis, :] - np.array(blazes, dtype=float)[np.newaxis, :, :]
+        isValid &= np.all(np.einsum('ijk,ijk->ij', gaps, gaps) >= minBlazeGap**2, axis=1)
+
+    voxels, offsets, band = voxels[isValid], offsets[isValid], band[isValid]
+    if len(voxels) == 0:
+        return None
+
+    # bands inside out, then z top down, then counterclockwise from the (-k, -k) corner
+    angle = (np.arctan2(offsets[:, 1], offsets[:, 0]) + 3*np.pi/4) % (2*np.pi)
+    first = np.lexsort((angle, -voxels[:, 2], band))[0]
+    return tuple(voxels[first].tolist())
+
+
+def generateHikingBlazes(start, occupancyMap, position, minBlazeGap, numBlazes=2, zLimit=(-15, -1), maxSearchDepth=50):
+    '''
+    Returns numBlazes voxels to fly past in turn, searching outwards from
+    start for each. position is the drone's, which hovers while searching.
+    '''
+    index      = occupancyMap.spatialIndex()
+    blazes     = []
+    blazeStart = occupancyMap.point2Voxel(start)
+
+    for _ in range(numBlazes):
+        nextBlaze = findBlaze(index, blazes, blazeStart, zLimit, position, minBlazeGap, maxSearchDepth=maxSearchDepth)
+
+        if nextBlaze is None:
+            raise Exception('Could not find a tree to blaze')
+
+        blazes.append(nextBlaze)
+        blazeStart = blazes[-1]
+
+    return blazes
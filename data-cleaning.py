@@ -61,7 +61,7 @@ for n, runDirectory in enumerate(os.listdir(RECORDING_DIRECTORY)):
     for i, record in enumerate(odometry):
         imageFile = str(record['imagefile'])
         try:
-            imageMap[imageFile] = np.array(PIL.Image.open(imageDirectory + '\\' + imageFile).convert('RGB'), dtype=np.float32) / 255
+            imageMap[imageFile] = np.asarray(PIL.Image.open(imageDirectory + '\\' + imageFile).convert('RGB')) # uint8, the models rescale
             validImages[i]      = True
 
         except PIL.UnidentifiedImageError:
@@ -91,7 +91,7 @@ for n, runDirectory in enumerate(os.listdir(RECORDING_DIRECTORY)):
     except ValueError: 
         sequenceStart = 0 # if runLength == TRAINING_SEQUENCE_LENGTH, randrange complains
 
-    imageSequence     = np.empty((TRAINING_SEQUENCE_LENGTH, *IMAGE_SHAPE)) 
+    imageSequence     = np.empty((TRAINING_SEQUENCE_LENGTH, *IMAGE_SHAPE), dtype=np.uint8)
     directionsSequence = np.empty((TRAINING_SEQUENCE_LENGTH, 3))
 
     for j in range(0, TRAINING_SEQUENCE_LENGTH):
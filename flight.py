@@ -9,7 +9,6 @@ import threading
 import random 
 import numpy as np
 import pprint
-import heapq
 import pickle
 import matplotlib.pyplot as plt
 import cv2
@@ -17,20 +16,18 @@ import os
 import csv
 import re
 import argparse
-from collections import OrderedDict
 from enum import Enum
 
 from scipy.spatial.transform import Rotation as R
 
-# Start up
-client = airsim.MultirotorClient() 
-client.confirmConnection() 
-client.enableApiControl(True) 
-
-# Weather
-client.simEnableWeather(True)
-client.simSetWeatherParameter(airsim.WeatherParameter.Fog, 0.0)
-client.simSetWeatherParameter(airsim.WeatherParameter.Rain, 0)
+from occupancy import VoxelOccupancyCache
+from planning import findPath, AnytimePlanner
+from blazes import generateHikingBlazes
+from splines import CubicSpline
+from pipeline import FlightPipeline
+from mock_client import MockWorld, MockMultirotorClient
+from timing import LoopTimer, NullLoopTimer
+from scheduler import FixedRateScheduler
 
 # Operating Modes
 class Task: 
@@ -39,6 +36,10 @@ class Task:
     MAZE = 'maze'
     HIKING = 'hiking'
 
+class Planner:
+    ASTAR   = 'astar'
+    ANYTIME = 'anytime'
+
 # Parameters
 parser = argparse.ArgumentParser(description='Fly the deepdrone agent in the Airsim simulator')
 parser.add_argument('--task',               type=str,   default='target', help='Task to attempt')
@@ -46,12 +47,17 @@ parser.add_argument('--endpoint_tolerance', type=float, default=10.0,      help=
 parser.add_argument('--near_task_radius',   type=float, default=15.0,     help='The max distance of endpoints in the near planning task')
 parser.add_argument('--far_task_radius',    type=float, default=50.0,     help='The max distance of endpoints in the far planning task')
 parser.add_argument('--min_blaze_gap',      type=float, default=10.0,     help='The minimum distance between hiking task blazes')
+parser.add_argument('--planner',            type=str,   default='astar',  help='Path planner to replan with: astar or anytime (ARA*)')
+parser.add_argument('--planning_budget',    type=float, default=0.5,      help='Fraction of the control period the anytime planner may spend each tick')
+parser.add_argument('--initial_epsilon',    type=float, default=5.0,      help='Starting heuristic inflation of the anytime planner')
 parser.add_argument('--plot_period',        type=float, default=0.5,      help='The time between updates of debug plotting information')
 parser.add_argument('--control_period',     type=float, default=0.7,      help='Update frequency of the pure pursuit controller')
 parser.add_argument('--speed',              type=float, default=0.5,      help='Drone flying speed')
 parser.add_argument('--voxel_size',         type=float, default=1.0,      help='The size of voxels in the occupancy map cache')
-parser.add_argument('--cache_size',         type=float, default=100000,   help='The number of entries in the local occupancy cache')
+parser.add_argument('--cache_size',         type=int,   default=4096,     help='The number of voxel chunks in the local occupancy cache')
+parser.add_argument('--chunk_size',         type=int,   default=16,       help='The side length in voxels of each occupancy cache chunk')
 parser.add_argument('--lookahead_distance', type=float, default=0.75,      help='Pure pursuit lookahead distance')
+parser.add_argument('--walk_length',        type=int,   default=5,        help='Number of steps in the random walk of the following task')
 parser.add_argument('--bogo_attempts',      type=int,   default=5000,     help='Number of attempts to make in generate and test algorithms')
 parser.add_argument('--n_runs',             type=int,   default=50,       help='Number of repetitions of the task to attempt')
 parser.add_argument("--plot_debug", dest="plot_debug", action="store_true")
@@ -62,8 +68,72 @@ parser.add_argument('--model_weights', type=str, default=None, help='Model weigh
 parser.add_argument('--seq_len', type=int, default=64)
 parser.add_argument('--batch_size', type=int, default=8)
 parser.add_argument('--rnn_size', type=int, default=32, help='Select the size of RNN network you would like to train')
+parser.add_argument('--inference', type=str, default='windowed', help='How to run the model each tick: predict, windowed (cached conv features, the recurrent layer still reruns over the window so O(seq_len) per tick, but outputs match the seq_len windows the model was trained on) or stateful (one recurrent step, O(1) per tick, but its state remembers past the window)')
+parser.add_argument('--inference_backend', type=str, default='function', help='Runtime for the model: keras (model.predict), function (tf.function) or tflite (XNNPACK)')
+parser.add_argument('--inference_threads', type=int, default=None, help='CPU threads for the tflite inference backend')
+parser.add_argument('--quantized_head', type=str, default=None, help='int8 TFLite conv head from quantize.py to run the streaming model with')
+parser.add_argument('--pipelined', dest='pipelined', action='store_true', help='Overlap frame capture, inference and command dispatch on separate threads when flying by a model')
+parser.set_defaults(pipelined=False)
+parser.add_argument('--validate_inference', dest='validate_inference', action='store_true', help='Check streaming inference against model.predict every tick')
+parser.set_defaults(validate_inference=False)
+parser.add_argument('--vehicles', type=str, nargs='*', default=None, help='Vehicles from the AirSim settings to fly together on the target task with batched inference, all of them if none are named')
+parser.add_argument('--mock', dest='mock', action='store_true', help='Fly in a local mock simulator instead of AirSim')
+parser.set_defaults(mock=False)
+parser.add_argument('--mock_vehicles', type=int, default=1, help='Number of vehicles in the mock simulator')
+parser.add_argument('--fixed_rate', dest='fixed_rate', action='store_true', help='Run the control loop on fixed control_period deadlines, with occupancy updates, replanning and plotting in slack time')
+parser.set_defaults(fixed_rate=False)
+parser.add_argument('--timing', dest='timing', action='store_true', help='Time each stage of the control loop and print a summary after each run')
+parser.set_defaults(timing=False)
+parser.add_argument('--timing_trace', type=str, default=None, help='JSONL file to append every control tick\'s stage times to (implies --timing)')
 args = parser.parse_args()
 
+# Control loop stage timing
+if args.timing or args.timing_trace is not None:
+    loopTimer = LoopTimer(args.control_period, args.timing_trace)
+else:
+    loopTimer = NullLoopTimer()
+
+# Start up
+# commands aren't joined when pipelined or at a fixed rate, so the mock world keeps wall clock time
+mockWorld = MockWorld(args.mock_vehicles, realtime=args.pipelined or args.fixed_rate) if args.mock else None
+
+def newClient():
+    '''
+    A new connection to the simulator, or to the mock world with --mock
+    '''
+    if mockWorld is not None:
+        return MockMultirotorClient(mockWorld)
+    return airsim.MultirotorClient()
+
+
+def printRpcCounts():
+    if mockWorld is not None:
+        print(f'{sum(mockWorld.rpcCounts.values())} rpcs:', ', '.join(f'{name} {count}' for name, count in mockWorld.rpcCounts.most_common()))
+
+client = newClient()
+client.confirmConnection() 
+
+# the pipeline captures and commands on its own threads, each with its own
+# client since rpc clients aren't thread safe. They're reused by every run.
+pipelineClients = None
+if args.pipelined:
+    pipelineClients = newClient(), newClient()
+    for pipelineClient in pipelineClients:
+        pipelineClient.confirmConnection()
+
+# The default vehicle, or every listed vehicle
+vehicleNames = [''] if args.vehicles is None else (args.vehicles or client.listVehicles())
+for vehicleName in vehicleNames:
+    client.enableApiControl(True, vehicleName)
+
+if len(vehicleNames) > 1 and (args.task != Task.TARGET or args.pipelined):
+    raise ValueError('Several vehicles can only fly the target task, without --pipelined')
+
+# Weather
+client.simEnableWeather(True)
+client.simSetWeatherParameter(airsim.WeatherParameter.Fog, 0.0)
+client.simSetWeatherParameter(airsim.WeatherParameter.Rain, 0)
+
 RECORDING_DIRECTORY    = 'C:/Users/MIT Driverless/Documents/AirSim'
 RECORDING_NAME_REGEX   = re.compile(r'^[0-9]+-[0-9]+-[0-9]+-[0-9]+-[0-9]+-[0-9]+$')
 
@@ -72,6 +142,7 @@ RADIANS_2_DEGREES    = 180 / np.pi
 CAMERA_OFFSET        = np.array([0.5, 0, -0.5])
 ENDPOINT_OFFSET      = np.array([0, -0.03, 0.025])
 MAX_INCLINATION      = 0.3
+PATH_LOOKAHEAD       = 2 # distance to the carrot when following a planned path
 DRONE_START          = np.array([-32295.757812, 2246.772705, 1894.547119])
 WORLD_2_UNREAL_SCALE = 100
 
@@ -83,168 +154,18 @@ IMAGE_SHAPE     = (256,256,3)
 flightModel = None
 if args.model_weights is not None:
     from tensorflow import keras
-    import kerasncp as kncp
-    from node_cell import *
+    from models import ChannelOrder, buildModel, modelNameFromWeights, residentMemory
+    from inference import StreamingModel
 
     # Parse out the model info from file path
-    weightsFile = args.model_weights.split('/')[-1]
-    modelName   = weightsFile[:weightsFile.index('-')]
-    # modelName   = 'ncp'
-
-    # Setup the network
-    wiring = kncp.wirings.NCP(
-        inter_neurons=12,   # Number of inter neurons
-        command_neurons=32,  # Number of command neurons
-        motor_neurons=3,    # Number of motor neurons
-        sensory_fanout=4,   # How many outgoing synapses has each sensory neuron
-        inter_fanout=4,     # How many outgoing synapses has each inter neuron
-        recurrent_command_synapses=4,   # Now many recurrent synapses are in the
-                                        # command neuron layer
-        motor_fanin=6,      # How many incoming syanpses has each motor neuron
-    )
-
-    rnnCell = kncp.LTCCell(wiring)
-
-    ncpModel = keras.models.Sequential()
-    ncpModel.add(keras.Input(shape=(args.seq_len, *IMAGE_SHAPE)))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=16, kernel_size=(5,5), strides=(3,3), activation='relu')))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=32, kernel_size=(3,3), strides=(2,2), activation='relu')))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=64, kernel_size=(2,2), strides=(2,2), activation='relu')))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=8, kernel_size=(2,2), strides=(2,2), activation='relu')))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Flatten()))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Dropout(rate=0.5)))
-    ncpModel.add(keras.layers.TimeDistributed(keras.layers.Dense(units=64,   activation='linear')))
-    ncpModel.add(keras.layers.RNN(rnnCell, return_sequences=True))
-
-    # NCP network with multiple input (Requires the Functional API)
-    imageInput        = ncpModel.layers[0].input
-    penultimateOutput = ncpModel.layers[-2].output
-    imageFeatures     = keras.layers.Dense(units=48, activation="linear")(penultimateOutput)
-
-    gpsInput    = keras.Input(shape = (args.seq_len, 3))
-    gpsFeatures = keras.layers.Dense(units=16, activation='linear')(gpsInput)
-
-    multiFeatures = keras.layers.concatenate([imageFeatures, gpsFeatures])
-
-    rnn, state = keras.layers.RNN(rnnCell, return_state=True)(multiFeatures)
-    npcMultiModel = keras.models.Model(inputs=[imageInput, gpsInput], outputs = [rnn])
-
-    # LSTM network
-    penultimateOutput = ncpModel.layers[-2].output
-    lstmOutput        = keras.layers.LSTM(units=args.rnn_size, return_sequences=True)(penultimateOutput)
-    lstmOutput        = keras.layers.Dense(units=3, activation='linear')(lstmOutput)
-    lstmModel = keras.models.Model(ncpModel.input, lstmOutput)
-
-    # LSTM multiple input network
-    lstmMultiOutput        = keras.layers.LSTM(units=args.rnn_size, return_sequences=True)(multiFeatures)
-    lstmMultiOutput        = keras.layers.Dense(units=3, activation='linear')(lstmMultiOutput)
-    lstmMultiModel = keras.models.Model(inputs=[imageInput, gpsInput], outputs=[lstmMultiOutput])
-
-    # for x in trainData:
-    #     (x1, x2), y = x
-    #     print(x1.shape)
-    #     print(x2.shape)
-    #     print(y.shape)
-    #     print(lstmMultiOutput.shape)
-    #     sys.exit()
-
-    # Vanilla RNN network
-    penultimateOutput = ncpModel.layers[-2].output
-    rnnOutput         = keras.layers.SimpleRNN(units=args.rnn_size, return_sequences=True)(penultimateOutput)
-    rnnOutput         = keras.layers.Dense(units=3, activation='linear')(rnnOutput)
-    rnnModel          = keras.models.Model(ncpModel.input, rnnOutput)
-
-    # Vanilla RNN multiple input network
-    rnnMultiOutput = keras.layers.SimpleRNN(units=args.rnn_size, return_sequences=True)(multiFeatures)
-    rnnMultiOutput = keras.layers.Dense(units=3, activation='linear')(rnnMultiOutput)
-    rnnMultiModel  = keras.models.Model(inputs=[imageInput, gpsInput], outputs=[rnnMultiOutput])
-
-    # GRU network
-    penultimateOutput = ncpModel.layers[-2].output
-    gruOutput         = keras.layers.GRU(units=args.rnn_size, return_sequences=True)(penultimateOutput)
-    gruOutput         = keras.layers.Dense(units=3, activation='linear')(gruOutput)
-    gruModel          = keras.models.Model(ncpModel.input, gruOutput)
-
-    # GRU multiple input network
-    gruMultiOutput = keras.layers.GRU(units=args.rnn_size, return_sequences=True)(multiFeatures)
-    gruMultiOutput = keras.layers.Dense(units=3, activation='linear')(gruMultiOutput)
-    gruMultiModel  = keras.models.Model(inputs=[imageInput, gpsInput], outputs=[gruMultiOutput])
-
-    # CT-GRU network
-    penultimateOutput  = ncpModel.layers[-2].output
-    ctgruCell          = CTGRU(units=args.rnn_size)
-    ctgruOutput        = keras.layers.RNN(ctgruCell, return_sequences=True)(penultimateOutput)
-    ctgruOutput        = keras.layers.Dense(units=3, activation='linear')(ctgruOutput)
-    ctgruModel         = keras.models.Model(ncpModel.input, ctgruOutput)
-
-    # CT-GRU multiple input network
-    ctgruMultiCell   = CTGRU(units=args.rnn_size)
-    ctgruMultiOutput = keras.layers.RNN(ctgruMultiCell, return_sequences=True)(multiFeatures)
-    ctgruMultiOutput = keras.layers.Dense(units=3, activation="linear")(ctgruMultiOutput)
-    ctgruMultiModel  = keras.models.Model(inputs=[imageInput, gpsInput], outputs=[ctgruMultiOutput])
-
-    # ODE-RNN network
-    penultimateOutput = ncpModel.layers[-2].output
-    odernnCell        = CTRNNCell(units=args.rnn_size, method='dopri5')
-    odernnOutput      = keras.layers.RNN(odernnCell, return_sequences=True)(penultimateOutput)
-    odernnOutput      = keras.layers.Dense(units=3, activation='linear')(odernnOutput)
-    odernnModel       = keras.models.Model(ncpModel.input, odernnOutput)
-
-    # ODE-RNN multiple input network
-    odernnMultiCell   = CTRNNCell(units=args.rnn_size, method='dopri5')
-    odernnMultiOutput = keras.layers.RNN(odernnMultiCell, return_sequences=True)(multiFeatures)
-    odernnMultiOutput = keras.layers.Dense(units=3, activation='linear')(odernnMultiOutput)
-    odernnMultiModel  = keras.models.Model(inputs=[imageInput, gpsInput], outputs=[odernnMultiOutput])
-
-    # CNN network
-    # Revision 2: 1000 and 100 units to 500 and 50 units
-    remove_ncp_layer = ncpModel.layers[-3].output
-    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dense(units=250, activation='relu'))(remove_ncp_layer)
-    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dropout(rate=0.5))(cnnOutput)
-    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dense(units=25, activation='relu'))(cnnOutput)
-    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dropout(rate=0.3))(cnnOutput)
-    cnnOutput = keras.layers.Dense(units=3, activation='linear')(cnnOutput)
-    cnnModel  = keras.models.Model(ncpModel.input, cnnOutput)
-
-    # CNN multiple input network
-    # TODO(cvorbach) Not sure if this makes sense for a cnn?
-
-    # Configure the model we will train
+    modelName = modelNameFromWeights(args.model_weights)
     print(modelName)
-    if not args.task == Task.MAZE:
-        if modelName == "lstm":
-            flightModel = lstmModel
-        elif modelName == "ncp":
-            flightModel = ncpModel
-        elif modelName == "cnn":
-            flightModel = cnnModel
-        elif modelName == "odernn":
-            flightModel = odernnModel
-        elif modelName == "gru":
-            flightModel = gruModel
-        elif modelName == "rnn":
-            flightModel = rnnModel
-        elif modelName == "ctgru":
-            flightModel = ctgruModel
-        else:
-            raise ValueError(f"Unsupported model type: {modelName}")
-    else:
-        if modelName == "lstm":
-            flightModel = lstmMultiModel
-        elif modelName == "ncp":
-            flightModel = npcMultiModel
-        elif modelName == "cnn":
-            raise ValueError(f"Unsupported model type: {modelName}")
-        elif modelName == "odernn":
-            flightModel = odernnMultiModel
-        elif modelName == "gru":
-            flightModel = gruMultiModel
-        elif modelName == "rnn":
-            flightModel = rnnMultiModel
-        elif modelName == "ctgru":
-            flightModel = ctgruMultiModel
-        else:
-            raise ValueError(f"Unsupported model type: {modelName}")
+
+    startupTime   = time.perf_counter()
+    startupMemory = residentMemory()
+
+    # Build only the model we will fly with, taking the camera's uint8 BGR images as they are
+    flightModel = buildModel(modelName, multi=args.task == Task.MAZE, seqLen=args.seq_len, rnnSize=args.rnn_size, channelOrder=ChannelOrder.BGR)
 
     flightModel.compile(
         optimizer=keras.optimizers.Adam(0.0005), loss="cosine_similarity",
@@ -254,6 +175,15 @@ if args.model_weights is not None:
     flightModel.load_weights(args.model_weights)
     flightModel.summary(line_length=80)
 
+    # Keep conv features and recurrent state across control ticks, one stream per vehicle
+    flightModel = StreamingModel(flightModel, args.seq_len, mode=args.inference, backend=args.inference_backend, numThreads=args.inference_threads, quantizedHead=args.quantized_head, validate=args.validate_inference, batchSize=len(vehicleNames))
+
+    memory = residentMemory()
+    if memory is not None:
+        print(f'Built {modelName} in {time.perf_counter() - startupTime:.1f}s, peak resident memory {startupMemory:.0f} MB -> {memory:.0f} MB')
+    else:
+        print(f'Built {modelName} in {time.perf_counter() - startupTime:.1f}s')
+
 # Utilities
 
 def normalize(vector):
@@ -326,6 +256,7 @@ class CatmullRomSpline:
             raise ValueError('Catmull Rom Spline requires at least 4 points')
 
         self.segments = []
+        self.coeff    = None
 
         # Create the initial segment
         self.p = list(p[:4])
@@ -351,22 +282,37 @@ class CatmullRomSpline:
             raise ValueError('Not enough points to extend Catmull Rom Spline')
 
         self.segments.append(CatmullRomSegment(segmentPoints))
+        self.coeff = None
 
-    def __call__(self, t):
+    def getCoeff(self):
         '''
-        Returns the value of the spline at s in [0, len(segments)+1]
-        where s is the spline parameterization
+        Returns the (n,4) coefficients of every segment, rebuilt lazily after extending
         '''
-        if t < 0 or t > 1:
+        if self.coeff is None:
+            self.coeff = np.array([segment.coeff for segment in self.segments])
+        return self.coeff
+
+    def segment(self, t):
+        t = np.asarray(t, dtype=float)
+        if np.any(t < 0) or np.any(t > 1):
             raise Exception(f"Catmull Rom Spline cannot extrapolate")
 
         s = t*len(self)
 
         # Index of segment to use
-        idx = min(int(s), len(self.segments)-1)
+        idx = np.minimum(s.astype(int), len(self.segments)-1)
         ds  = s - idx
 
-        value = self.segments[idx](ds)
+        return self.getCoeff()[idx].T, ds
+
+    def __call__(self, t):
+        '''
+        Returns the value of the spline at s in [0, len(segments)+1]
+        where s is the spline parameterization
+        '''
+        (a, b, c, d), ds = self.segment(t)
+
+        value = a*ds**3 + b*ds**2 + c*ds + d
         return value
 
     def ddt(self, t):
@@ -374,16 +320,10 @@ class CatmullRomSpline:
         Returns the value of the spline at s in [0, len(segments)+1]
         where s is the spline parameter
         '''
-        if t < 0 or t > 1:
-            raise Exception(f"Catmull Rom Spline cannot extrapolate")
-
-        s = t*len(self)
+        (a, b, c, d), ds = self.segment(t)
 
-        # Index of segment to use
-        idx = min(int(s), len(self.segments)-1)
-        ds  = s - idx
-
-        derivative = self.segments[idx].ddt(ds)
+        derivative = 3*a*ds**2 + 2*b*ds + c
+        return derivative
 
     def end(self):
         return self(len(segments))
@@ -391,6 +331,7 @@ class CatmullRomSpline:
     def pop(self, s):
         self.segments.pop()
         self.p.pop()
+        self.coeff = None
 
     def __len__(self):
       return len(self.segments)
@@ -412,23 +353,22 @@ class ExtendablePath:
         self.zSpline.extend(list(newPoints[:, 2]))
 
     def __call__(self, t):
-        return np.array([
+        return np.stack([
             self.xSpline(t),
             self.ySpline(t),
             self.zSpline(t)
-        ])
+        ], axis=-1)
 
     def tangent(self, t):
-        return np.array([
+        return np.stack([
             self.xSpline.ddt(t),
             self.ySpline.ddt(t),
             self.zSpline.ddt(t)
-        ])
+        ], axis=-1)
 
     def project(self, point):
-        position, _ = getPose()
         tSamples    = np.linspace(0, 1, num=1000)
-        nearestT    = tSamples[np.argmin([np.linalg.norm(position - self(t)) for t in tSamples])]
+        nearestT    = tSamples[np.argmin(np.linalg.norm(self(tSamples) - point, axis=1))]
 
         return nearestT
     
@@ -439,159 +379,84 @@ class ExtendablePath:
         return len(self.xSpline.segments)
 
 
-class CubicSpline:
-    def __init__(self, x, y, tol=1e-10):
-        self.x = x
-        self.y = y
-        self.coeff = self.fit(x, y, tol)
-
-    def fit(self, x, y, tol=1e-10):
-        """
-        Interpolate using natural cubic splines.
-    
-        Generates a strictly diagonal dominant matrix then solves.
-    
-        Returns coefficients:
-        b, coefficient of x of degree 1
-        c, coefficient of x of degree 2
-        d, coefficient of x of degree 3
-        """ 
-    
-        x = np.array(x)
-        y = np.array(y)
-    
-        # check if sorted
-        if np.any(np.diff(x) < 0):
-            idx = np.argsort(x)
-            x = x[idx]
-            y = y[idx]
-
-        size = len(x)
-        delta_x = np.diff(x)
-        delta_y = np.diff(y)
-    
-        # Initialize to solve Ac = k
-        A = np.zeros(shape = (size,size))
-        k = np.zeros(shape=(size,1))
-        A[0,0] = 1
-        A[-1,-1] = 1
-    
-        for i in range(1,size-1):
-            A[i, i-1] = delta_x[i-1]
-            A[i, i+1] = delta_x[i]
-            A[i,i] = 2*(delta_x[i-1]+delta_x[i])
-
-            k[i,0] = 3*(delta_y[i]/delta_x[i] - delta_y[i-1]/delta_x[i-1])
-    
-        # Solves for c in Ac = k
-        c = np.linalg.solve(A, k)
-    
-        # Solves for d and b
-        d = np.zeros(shape = (size-1,1))
-        b = np.zeros(shape = (size-1,1))
-        for i in range(0,len(d)):
-            d[i] = (c[i+1] - c[i]) / (3*delta_x[i])
-            b[i] = (delta_y[i]/delta_x[i]) - (delta_x[i]/3)*(2*c[i] + c[i+1])    
-    
-        return b.squeeze(), c.squeeze(), d.squeeze()
-
-    def __call__(self, t):
-        '''
-        Returns the value of the spline at t in [x[0], x[-1]]
-        '''
+class Path:
+    def __init__(self, knotPoints, samplesPerKnot=10):
+        self.samplesPerKnot = samplesPerKnot
+        self.fit(knotPoints)
 
-        x = self.x
-        y = self.y
-        b, c, d = self.coeff
+    def fit(self, knotPoints):
+        self.knotPoints = knotPoints
 
-        # TODO(cvorbach) allow extrapolation
-        if t < x[0] or t > x[-1]:
-            raise Exception("Can't extrapolate")
+        # one spline fits all three axes against the same t
+        knots = np.array(knotPoints)
+        t = np.linspace(0, 1, knots.shape[0])
+        self.spline = CubicSpline(t, knots)
 
-        # Index of segment to use
-        idx = np.argmax(x > t) - 1
-                
-        dx = t - x[idx]
-        value = y[idx] + b[idx]*dx + c[idx]*dx**2 + d[idx]*dx**3
-        return value
+        # cumulative arc length table over a dense sampling of t
+        self.tSamples     = np.linspace(0, 1, self.samplesPerKnot * (knots.shape[0] - 1) + 1)
+        self.pointSamples = self.spline(self.tSamples)
+        self.arcLengths   = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(self.pointSamples, axis=0), axis=1))])
+        self.length       = self.arcLengths[-1]
 
-    def ddt(self, t):
-        '''
-        Returns the derivative of the spline at t in [x[0], x[-1]]
-        '''
+    def arcLengthAt(self, t):
+        return np.interp(t, self.tSamples, self.arcLengths)
 
-        x = self.x
-        y = self.y
-        b, c, d = self.coeff
+    def tAtArcLength(self, s):
+        return np.interp(s, self.arcLengths, self.tSamples)
 
-        # TODO(cvorbach) allow extrapolation
-        if t < x[0] or t > x[-1]:
-            raise Exception("Can't extrapolate")
+    def __call__(self, t):
+        return self.spline(t)
 
-        # Index of segment to use
-        idx = np.argmax(x > t) - 1
+    def tangent(self, t):
+        return self.spline.ddt(t)
 
-        dx         = t - x[idx]
-        derivative = b[idx] + 2*c[idx]*dx + 3*d[idx]*dx**2
-        return derivative
+    def normal(self, t):
+        return normalize(self.spline.d2dt2(t))
 
-    def d2dt2(self, t):
+    def project(self, point, tHint=None, window=5.0, iterations=4):
         '''
-        Returns the second derivative of the spline at t in [x[0], x[-1]]
+        Returns the t of the point on the path nearest to point.
+
+        The nearest cached sample, optionally only within window arc length
+        of tHint, is refined with Newton steps on |path(t) - point|^2. If
+        nothing in the window is within window of point, all samples are
+        searched.
         '''
+        point = np.asarray(point)
 
-        x = self.x
-        y = self.y
-        b, c, d = self.coeff
+        t = None
+        if tHint is not None:
+            s      = self.arcLengthAt(tHint)
+            lo, hi = np.searchsorted(self.arcLengths, [s - window, s + window])
+            hi     = max(hi, lo + 1)
 
-        # TODO(cvorbach) allow extrapolation
-        if t < x[0] or t > x[-1]:
-            raise Exception("Can't extrapolate")
+            offsets   = self.pointSamples[lo:hi] - point
+            distances = np.einsum('ij,ij->i', offsets, offsets)
+            nearest   = np.argmin(distances)
+            if distances[nearest] <= window**2:
+                t = self.tSamples[lo + nearest]
 
-        # Index of segment to use
-        idx = np.argmax(x > t) - 1
-        secondDerivative = 2*c[idx] + 6*d[idx]*dx
-        return secondDerivative
+        if t is None:
+            offsets = self.pointSamples - point
+            t       = self.tSamples[np.argmin(np.einsum('ij,ij->i', offsets, offsets))]
 
-class Path:
-    def __init__(self, knotPoints):
-        self.knotPoints = knotPoints
-        self.fit(knotPoints)
+        for _ in range(iterations):
+            value, tangent, secondDerivative = self.spline.derivatives(t)
 
-    def fit(self, knotPoints):
-        knots = np.array(knotPoints)
-        t = np.linspace(0, 1, knots.shape[0])
-        self.xSpline = CubicSpline(t, knots[:, 0])
-        self.ySpline = CubicSpline(t, knots[:, 1])
-        self.zSpline = CubicSpline(t, knots[:, 2])
-
-    def __call__(self, t):
-        return np.array([
-            self.xSpline(t),
-            self.ySpline(t),
-            self.zSpline(t)
-        ])
+            offset    = value - point
+            gradient  = offset @ tangent
+            curvature = tangent @ tangent + offset @ secondDerivative
 
-    def tangent(self, t):
-        return np.array([
-            self.xSpline.ddt(t),
-            self.ySpline.ddt(t),
-            self.zSpline.ddt(t)
-        ])
+            # away from a minimum newton steps can climb, keep the sample
+            if curvature <= 0:
+                break
 
-    def normal(self, t):
-        tangentDerivative = np.array([
-            self.xSpline.d2dt2(t),
-            self.ySpline.d2dt2(t),
-            self.zSpline.d2dt2(t)
-        ])
-        return normalize(tangentDerivative)
+            step = gradient / curvature
+            t    = min(max(t - step, 0.0), 1.0)
+            if abs(step) < 1e-9:
+                break
 
-    def project(self, point):
-        position, _ = getPose()
-        tSamples = np.linspace(0, 1, num=1000)
-        nearstT  = tSamples[np.argmin([np.linalg.norm(position - self(t)) for t in tSamples])]
-        return nearstT
+        return t
     
     def end(self):
         return self.knotPoints[-1]
@@ -635,151 +500,85 @@ class Path:
 #     #     self.x        = nextX
 #     #     self.momentum = nextMomentum
 
-def randomWalk(start, momentumWeight=0.5, stepSize=3, gradientLimit=np.pi/12, zLimit=(-20, -10), pathLength=5, occupancyMap=None, retryLimit = 10):
-    normalDistribution = np.random.default_rng().normal 
-    momentum = normalize(np.array([normalDistribution(), normalDistribution(), normalDistribution()]))
-    path = [start]
-
-    for i in range(retryLimit):
-        for _ in range(pathLength):
-
-            # Generate an unoccupied next step in the random walk
-            isUnoccupiedNextStep = False
-            stuckSteps = 0
-            while not isUnoccupiedNextStep:
-                rotation = R.from_matrix([[momentum[0], 0, 0], [0, momentum[1], 0], [0, 0, momentum[2]]])
-                perturbance = rotation.apply(normalize(np.array((0, normalDistribution(), normalDistribution()))))
-
-                # the continue in previous direction with a random perturbance left/right and up/down
-                stepDirection = normalize(momentumWeight * momentum + (1 - momentumWeight) * perturbance)
-
-                # apply gradient limit
-                heading = rotation.apply([1, 0, 0])
-                stepDirection  = np.array([min(max(u - heading[i], -gradientLimit), gradientLimit) for i, u in enumerate(stepDirection)]) 
-                stepDirection += heading
-
-                step          = stepSize * stepDirection
-
-                nextStep = path[-1] + step
-
-                # apply altitude limits
-                nextStep[2] = min(max(nextStep[2], zLimit[0]), zLimit[1])
-
-                isUnoccupiedNextStep = occupancyMap is None or nextStep not in occupancyMap 
-
-                stuckSteps += int(not isUnoccupiedNextStep)
-                if stuckSteps > retryLimit:
-                    break 
-
-            path.append(nextStep)
-
-        if stuckSteps < retryLimit:
-            break
-
-    if i > retryLimit:
-        raise Exception('Couldn\'t find free random walk')
-
-    return path
-
-# Utilities
-class LRUCache:
-    def __init__(self, capacity: int):
-        self.cache = OrderedDict()
-        self.capacity = capacity
-
-    def __contains__(self, key):
-        if key in self.cache:
-            self.cache.move_to_end(key) # Move to front of LRU cache
-            return True
-        return False
-
-    def add(self, key):
-        self.cache[key] = None          # Don't care about the dict's value, just its set of keys
-        self.cache.move_to_end(key)
-        if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
-
-    def discard(self, key):
-        self.cache.pop(key, None)
-
-    def keys(self):
-        return list(self.cache.keys())
-
-class VoxelOccupancyCache:
-
-    def __init__(self, voxelSize: float, capacity: int):
-        self.voxelSize  = voxelSize
-        self.cache      = LRUCache(capacity)
-    
-    def addPoint(self, point):
-        voxel = self.point2Voxel(point)
-
-        self.cache.add(voxel)
-        for v in self.getAdjacentVoxels(voxel):
-            self.cache.add(v)
-
-    def __contains__(self, point):
-        voxel = self.point2Voxel(point)
-        return voxel in self.cache
-
-    def point2Voxel(self, point):
-        return tuple(self.voxelSize * int(round(v / self.voxelSize)) for v in point)
-
-    def getAdjacentVoxels(self, voxel):
-        adjacentVoxels = [
-            (voxel[0] - 1, voxel[1] - 1, voxel[2] - 1),
-            (voxel[0],     voxel[1] - 1, voxel[2] - 1),
-            (voxel[0] + 1, voxel[1] - 1, voxel[2] - 1),
-
-            (voxel[0] - 1, voxel[1], voxel[2] - 1),
-            (voxel[0],     voxel[1], voxel[2] - 1),
-            (voxel[0] + 1, voxel[1], voxel[2] - 1),
-
-            (voxel[0] - 1, voxel[1] + 1, voxel[2] - 1),
-            (voxel[0],     voxel[1] + 1, voxel[2] - 1),
-            (voxel[0] + 1, voxel[1] + 1, voxel[2] - 1),
-
-            (voxel[0] - 1, voxel[1] - 1, voxel[2]),
-            (voxel[0],     voxel[1] - 1, voxel[2]),
-            (voxel[0] + 1, voxel[1] - 1, voxel[2]),
-
-            (voxel[0] - 1, voxel[1], voxel[2]),
-            (voxel[0],     voxel[1], voxel[2]),
-            (voxel[0] + 1, voxel[1], voxel[2]),
-
-            (voxel[0] - 1, voxel[1] + 1, voxel[2]),
-            (voxel[0],     voxel[1] + 1, voxel[2]),
-            (voxel[0] + 1, voxel[1] + 1, voxel[2]),
-
-            (voxel[0] - 1, voxel[1] - 1, voxel[2] + 1),
-            (voxel[0],     voxel[1] - 1, voxel[2] + 1),
-            (voxel[0] + 1, voxel[1] - 1, voxel[2] + 1),
-
-            (voxel[0] - 1, voxel[1], voxel[2] + 1),
-            (voxel[0],     voxel[1], voxel[2] + 1),
-            (voxel[0] + 1, voxel[1], voxel[2] + 1),
+def clampedWalk(start, steps, zLimit):
+    '''
+    The points reached taking each of the (N,3) steps in turn from start,
+    with the altitude clamped to zLimit after every step
+    '''
+    points = start + np.cumsum(steps, axis=0)
 
-            (voxel[0] - 1, voxel[1] + 1, voxel[2] + 1),
-            (voxel[0],     voxel[1] + 1, voxel[2] + 1),
-            (voxel[0] + 1, voxel[1] + 1, voxel[2] + 1),
-        ]
+    z = start[2]
+    for j, dz in enumerate(steps[:, 2].tolist()):
+        z = min(max(z + dz, zLimit[0]), zLimit[1])
+        points[j, 2] = z
 
-        return adjacentVoxels
+    return points
 
-    def getNextSteps(self, voxel, endpoint):
-        neighbors = []
-        possibleNeighbors = self.getAdjacentVoxels(voxel)
 
-        for v in possibleNeighbors:
-            if v not in self.cache or distance(np.array(v), np.array(endpoint)) < args.endpoint_tolerance:
-                neighbors.append(v) 
+def randomWalk(start, momentumWeight=0.5, stepSize=3, gradientLimit=np.pi/12, zLimit=(-20, -10), pathLength=5, occupancyMap=None, retryLimit = 10):
+    '''
+    A walk of pathLength steps from start that holds its random initial
+    heading, perturbed left/right and up/down. Each step takes the first
+    free one of retryLimit + 1 candidate steps, and a walk that gets stuck
+    starts over, up to retryLimit times.
+    '''
+    rng = np.random.default_rng()
+    momentum = normalize(rng.normal(size=3))
+
+    # R.from_matrix(diag(momentum)) rounds to a half turn about the axis of the
+    # largest component or to the identity, either way a diagonal of signs
+    signs = np.ones(3)
+    if np.sum(momentum) < np.max(momentum):
+        signs = -signs
+        signs[np.argmax(momentum)] = 1
+    heading = signs * [1, 0, 0]
+
+    candidates = retryLimit + 1
+    for _ in range(retryLimit):
+        # the candidate steps of the whole walk at once
+        noise = rng.normal(size=(pathLength, candidates, 2))
+        perturbance = np.zeros((pathLength, candidates, 3))
+        perturbance[:, :, 1:] = signs[1:] * noise / np.linalg.norm(noise, axis=2, keepdims=True)
+
+        # continue in the previous direction with a random perturbance left/right and up/down
+        stepDirections  = momentumWeight * momentum + (1 - momentumWeight) * perturbance
+        stepDirections /= np.linalg.norm(stepDirections, axis=2, keepdims=True)
+
+        # apply gradient limit
+        steps = stepSize * (heading + np.clip(stepDirections - heading, -gradientLimit, gradientLimit))
+
+        path = np.empty((pathLength + 1, 3))
+        path[0] = start
+
+        i = 0
+        while i < pathLength:
+            # take the first candidate of every step left and test them all at once
+            ahead = clampedWalk(path[i], steps[i:, 0], zLimit)
+            isOccupied = np.zeros(len(ahead), dtype=bool) if occupancyMap is None else occupancyMap.containsPoints(ahead)
+            free = len(ahead) if not np.any(isOccupied) else np.argmax(isOccupied)
+
+            path[i + 1:i + 1 + free] = ahead[:free]
+            i += free
+            if i == pathLength:
+                return [start] + list(path[1:])
+
+            # the first candidate of step i is occupied, try the others
+            nextSteps = path[i] + steps[i]
+
+            # apply altitude limits
+            nextSteps[:, 2] = np.clip(nextSteps[:, 2], zLimit[0], zLimit[1])
+
+            isUnoccupied = ~occupancyMap.containsPoints(nextSteps)
+            if not np.any(isUnoccupied):
+                break
 
-        return neighbors
+            path[i + 1] = nextSteps[np.argmax(isUnoccupied)]
+            i += 1
 
-    def plotOccupancies(self):
-        occupiedPoints = [Vector3r(float(v[0]), float(v[1]), float(v[2])) for v in self.cache.keys()]
-        client.simPlotPoints(occupiedPoints, color_rgba = [0.0, 0.0, 1.0, 1.0], duration=args.plot_period/2.0) 
+        if i == pathLength:
+            return [start] + list(path[1:])
 
+    raise Exception('Couldn\'t find free random walk')
 
 def world2UnrealCoordinates(vector):
     return (vector + DRONE_START) * WORLD_2_UNREAL_SCALE
@@ -789,26 +588,25 @@ def unreal2WorldCoordinates(vector):
     return (vector - DRONE_START) / WORLD_2_UNREAL_SCALE
 
 
-def isVisible(point, position, orientation):
-    # Edge case point == position
-    if distance(point, position) < 0.05:
-        return True
-
+def areVisible(points, position, orientation):
+    '''
+    Checks which of the (N,3) points are in the camera's field of view
+    '''
     # Check if endpoint is in frustrum
     xUnit = np.array([1, 0, 0])
     cameraDirection = R.from_quat(orientation).apply(xUnit)
 
-    endpointDirection = normalize(point - position)
+    displacements = points - position
+    distances     = np.linalg.norm(displacements, axis=1)
 
     # TODO(cvorbach) check square, not circle
-    angle = np.arccos(np.dot(cameraDirection, endpointDirection)) 
-
-    if abs(angle) > CAMERA_FOV:
-        return False
+    with np.errstate(invalid='ignore', divide='ignore'):
+        angles = np.arccos(np.clip(displacements @ cameraDirection / distances, -1, 1))
 
     # TODO(cvorbach) Check for occlusions with ray-tracing
 
-    return True
+    # Edge case point == position
+    return (distances < 0.05) | (np.abs(angles) <= CAMERA_FOV)
 
 
 def orientationAt(endpoint, position):
@@ -819,133 +617,129 @@ def orientationAt(endpoint, position):
 
     return orientation
 
-def euclidean(voxel1, voxel2):
-    return distance(np.array(voxel1), np.array(voxel2))
-
-def greedy(voxel1, voxel2):
-    return 100*euclidean(voxel1, voxel2)
-
-# A* Path finding 
-def findPath(startpoint, endpoint, occupancyMap, h=greedy, d=euclidean):
-    start = occupancyMap.point2Voxel(startpoint)
-    end   = occupancyMap.point2Voxel(endpoint)
-
-    cameFrom = dict()
-
-    gScore = dict()
-    gScore[start] = 0
+class VehicleState:
+    '''
+    Snapshot of a vehicle's pose and, when asked for, the simulation time,
+    fetched once per tick or query and passed down instead of asking the
+    simulator again
+    '''
+    def __init__(self, position, orientation, time):
+        self.position    = position
+        self.orientation = orientation
+        self.time        = time
 
-    fScore = dict()
-    fScore[start] = h(start, endpoint)
 
-    openSet = [(fScore[start], start)]
+def getState(vehicleName='', rpcClient=client, withTime=False):
+    '''
+    The ground truth pose, and the simulation time only if withTime since
+    it takes a second rpc
+    '''
+    pose        = rpcClient.simGetVehiclePose(vehicle_name=vehicleName)
+    position    = pose.position.to_numpy_array() - CAMERA_OFFSET
+    orientation = pose.orientation.to_numpy_array()
+    timestamp   = rpcClient.getMultirotorState(vehicle_name=vehicleName).timestamp if withTime else None
+    return VehicleState(position, orientation, None if timestamp is None else 1e-9 * timestamp)
 
-    while openSet:
-        current = heapq.heappop(openSet)[1]
 
-        # client.simPlotPoints([Vector3r(*current)], duration = 60)
+def getPose(vehicleName=''):
+    state = getState(vehicleName)
+    return state.position, state.orientation
 
-        if current == end:
-            path = [current]
-            while path[-1] != start:
-                current = cameFrom[current]
-                path.append(current)
-            
-            return list(reversed(path))
 
-        for neighbor in occupancyMap.getNextSteps(current, end):
+def getImage(rpcClient=client, vehicleName=''):
+    '''
+    Returns the front camera image as uint8 BGR, a view of the rpc response.
+    The flight model reorders the channels and rescales itself.
+    '''
+    image = None
+    while image is None or len(image) == 1:
+        image = rpcClient.simGetImages([airsim.ImageRequest('0', airsim.ImageType.Scene, False, False)], vehicle_name=vehicleName)[0]
+        image = np.frombuffer(image.image_data_uint8, dtype=np.uint8)
+    return image.reshape(IMAGE_SHAPE)
 
-            # # skip neighbors from which the endpoint isn't visible
-            # neighborOrientation = orientationAt(endpoint, neighbor)
-            # if not isVisible(np.array(end), np.array(neighbor), neighborOrientation):
-            #     continue
 
-            tentativeGScore = gScore.get(current, float("inf")) + d(current, neighbor)
+def startFlightPipeline():
+    '''
+    Captures frames and sends velocity commands on their own threads,
+    through the pipeline's clients
+    '''
+    captureClient, commandClient = pipelineClients
 
-            if tentativeGScore < gScore.get(neighbor, float('inf')):
-                cameFrom[neighbor] = current
-                gScore[neighbor]   = tentativeGScore
+    def capture():
+        return getImage(captureClient), getState(rpcClient=captureClient, withTime=args.plot_debug)
 
-                if neighbor in fScore:
-                    try:
-                        openSet.remove((fScore[neighbor], neighbor))
-                    except:
-                        pass
-                fScore[neighbor]   = gScore.get(neighbor, float('inf')) + h(neighbor, endpoint)
+    # a new command preempts the last one, each still lasts a control period if the pipeline stalls
+    def command(item):
+        velocity, yawAngle = item
+        commandClient.moveByVelocityAsync(float(velocity[0]), float(velocity[1]), float(velocity[2]), args.control_period, yaw_mode=YawMode(is_rate = False, yaw_or_rate = yawAngle))
 
-                heapq.heappush(openSet, (fScore[neighbor], neighbor))
-        
-    raise ValueError("Couldn't find a path")
+    return FlightPipeline(capture, command).start()
 
 
-def getTime():
-    return 1e-9 * client.getMultirotorState().timestamp
+def areValidEndpoints(endpoints, occupancyMap, state):
+    isValid = ~occupancyMap.containsPoints(endpoints)
+    isValid &= areVisible(endpoints, state.position, state.orientation)
 
+    # TODO(cvorbach) Check there is a valid path
 
-def getPose():
-    pose        = client.simGetVehiclePose()
-    position    = pose.position.to_numpy_array() - CAMERA_OFFSET
-    orientation = pose.orientation.to_numpy_array()
-    return position, orientation
+    return isValid
 
 
-def isValidEndpoint(endpoint, occupancyMap):
-    if endpoint in occupancyMap:
-        return False
+def firstValidEndpoint(sample, occupancyMap, state):
+    '''
+    Tests candidate endpoints from sample(n), an (n,3) array, in batches
+    that double in size, returning the first valid one or None once
+    args.bogo_attempts candidates have failed
+    '''
+    attempts  = 0
+    batchSize = 64
+    while attempts < args.bogo_attempts:
+        endpoints = sample(min(batchSize, args.bogo_attempts - attempts))
+        isValid   = areValidEndpoints(endpoints, occupancyMap, state)
+        if np.any(isValid):
+            return endpoints[np.argmax(isValid)]
 
-    position, orientation = getPose()
-    if not isVisible(endpoint, position, orientation):
-        return False
+        attempts  += len(endpoints)
+        batchSize *= 2
 
-    # TODO(cvorbach) Check there is a valid path
+    return None
 
-    return True
 
+def generateMazeTarget(occupancyMap, radius=50, zLimit=[-30, -10], vehicleName=''):
+    state = getState(vehicleName) # the vehicle hovers while targets are tried
 
-def generateMazeTarget(occupancyMap, radius=50, zLimit=[-30, -10]):
-    isValid = False
-    attempts = 0
-    while not isValid:
-        endpoint = np.array([
-            2 * radius * (random.random() - 0.5), 
-            2 * radius * (random.random() - 0.5), 
-            (zLimit[0] - zLimit[1]) * random.random() + zLimit[1]])
+    def sample(n):
+        uniform = np.random.random_sample((n, 3))
 
         # yawRotation = R.from_euler('xyz', [0, 0, R.from_quat(orientation).as_euler('xyz')[2]])
         # endpoint = position + yawRotation.apply(occupancyMap.point2Voxel(radius * normalize(np.array([random.random(), random.random(), -random.random()]) - 0.5)))
         # endpoint[2] = min(max(endpoint[2], zLimit[0]), zLimit[1])
 
-        isValid = endpoint not in occupancyMap
-        isValid = isValid and isValidEndpoint(endpoint, occupancyMap)
+        return np.stack([
+            2 * radius * (uniform[:, 0] - 0.5),
+            2 * radius * (uniform[:, 1] - 0.5),
+            (zLimit[0] - zLimit[1]) * uniform[:, 2] + zLimit[1]], axis=1)
 
-        attempts += 1
-        if attempts > args.bogo_attempts:
-            return None
-
-    return endpoint
+    return firstValidEndpoint(sample, occupancyMap, state)
 
 
 def generateTarget(occupancyMap, radius=10, zLimit=(-float('inf'), float('inf'))):
-    isValid = False
-    attempts = 0
-    while not isValid:
-        # TODO(cvorbach) smarter generation without creating points under terrain
-        position, orientation = getPose()
-        yawRotation = R.from_euler('xyz', [0, 0, R.from_quat(orientation).as_euler('xyz')[2]])
+    state       = getState() # the vehicle hovers while targets are tried
+    yawRotation = R.from_euler('xyz', [0, 0, R.from_quat(state.orientation).as_euler('xyz')[2]])
+    voxelSize   = occupancyMap.voxelSize
 
-        endpoint = position + yawRotation.apply(occupancyMap.point2Voxel(radius * normalize(np.array([random.random(), 0.1*random.random(), -random.random()]))))
+    def sample(n):
+        # TODO(cvorbach) smarter generation without creating points under terrain
+        directions = np.random.random_sample((n, 3)) * [1, 0.1, -1]
+        offsets    = radius * directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        endpoints  = state.position + yawRotation.apply(voxelSize * np.rint(offsets / voxelSize))
 
         # Altitude limit
-        endpoint[2] = min(max(endpoint[2], zLimit[0]), zLimit[1])
-
-        endpoint = occupancyMap.point2Voxel(endpoint)
-        isValid = isValidEndpoint(endpoint, occupancyMap)
+        endpoints[:, 2] = np.clip(endpoints[:, 2], zLimit[0], zLimit[1])
 
-        attempts += 1
-        if attempts > args.bogo_attempts:
-            return None
+        return voxelSize * np.rint(endpoints / voxelSize)
 
-    return np.array(endpoint)
+    return firstValidEndpoint(sample, occupancyMap, state)
 
 
 def turnTowardEndpoint(endpoint, timeout=0.01):
@@ -957,99 +751,104 @@ def turnTowardEndpoint(endpoint, timeout=0.01):
     print("Turned toward endpoint")
 
 
-def tryPlotting(lastPlotTime, occupancyMap):
-    if getTime() < args.plot_period + lastPlotTime:
+def tryPlotting(lastPlotTime, occupancyMap, now):
+    if now < args.plot_period + lastPlotTime:
         return lastPlotTime
 
-    # occupancyMap.plotOccupancies()
+    # occupancyMap.plotOccupancies(client, args.plot_period/2.0)
 
     print("Replotted :)")
-    return getTime()
+    return now
 
 
-def updateOccupancies(occupancyMap):
-    lidarData = client.getLidarData()
+def updateOccupancies(occupancyMap, vehicleName=''):
+    lidarData = client.getLidarData(vehicle_name=vehicleName)
     lidarPoints = np.array(lidarData.point_cloud, dtype=np.dtype('f4'))
     if len(lidarPoints) >=3:
         lidarPoints = np.reshape(lidarPoints, (lidarPoints.shape[0] // 3, 3))
-
-        for p in lidarPoints:
-            occupancyMap.addPoint(p)
+        occupancyMap.addPoints(lidarPoints)
 
     # print("Lidar data added")
 
 
-def getNearestPoint(trajectory, position):
-    closestDist = None
-    for i in range(len(trajectory)):
-        point = trajectory[i]
-        dist  = distance(point, position)
+class Trajectory:
+    '''
+    Waypoints stored as an (n,3) array with precomputed segment lengths and
+    cumulative arc length so pursuit queries are single vector operations
+    '''
+    def __init__(self, points):
+        self.points = np.array(points, dtype=float).reshape(-1, 3)
+        if len(self.points) <= 1:
+            raise Exception("Trajectory is too short")
 
-        if closestDist is None or dist < closestDist:
-            closestDist = dist
-            closestIdx  = i
+        self.segments       = np.diff(self.points, axis=0)
+        self.segmentLengths = np.linalg.norm(self.segments, axis=1)
+        self.arcLengths     = np.concatenate([[0], np.cumsum(self.segmentLengths)])
 
-    return closestIdx
+    def nearestIndex(self, position):
+        offsets = self.points - position
+        return int(np.argmin(np.einsum('ij,ij->i', offsets, offsets)))
 
+    def progress(self, currentIdx, position):
+        '''
+        Arc length to the waypoint currentIdx plus the projection of position onto the following segment
+        '''
+        progress = self.arcLengths[currentIdx]
+        if currentIdx < len(self.segments):
+            progress += (position - self.points[currentIdx]).dot(self.segments[currentIdx]) / self.segmentLengths[currentIdx]
+        return progress
 
-def getProgress(trajectory, currentIdx, position):
-    if len(trajectory) <= 1:
-        raise Exception("Trajectory is too short")
+    def pointAtArcLength(self, s):
+        '''
+        Linearly interpolates the waypoints at arc length s, holding the last waypoint past the end
+        '''
+        aheadIdx = max(int(np.searchsorted(self.arcLengths, s, side='right')), 1)
+        if aheadIdx == len(self.points):
+            return self.points[-1]
 
-    progress = 0
-    for i in range(len(trajectory) - 1):
-        p1 = trajectory[i]
-        p2 = trajectory[i+1]
+        behindWeight = (self.arcLengths[aheadIdx] - s) / self.segmentLengths[aheadIdx - 1]
 
-        if i < currentIdx:
-            progress += distance(p2, p1)
-        else:
-            partialProgress = (position - p1).dot(p2 - p1) / np.linalg.norm(p2 - p1)
-            progress += partialProgress
-            break
+        # sanity check
+        if not 0 <= behindWeight <= 1:
+            raise Exception("Invalid Interpolation Weights")
 
-    return progress
+        return self.points[aheadIdx] - behindWeight * self.segments[aheadIdx - 1]
 
+    def __getitem__(self, idx):
+        return self.points[idx]
 
-def pursuitVelocity(trajectory):
-    '''
-    This function is kinda of a mess, but basically it implements 
-    carrot following of a lookahead.
+    def __len__(self):
+        return len(self.points)
 
-    The three steps are:
-    1. Find the point on the path nearest to the drone as start of carrot
-    2. Find points in front of and behind the look ahead point by arc length
-    3. Linearly interpolate to find the lookahead point and chase it.
-    '''
 
-    position, _ = getPose()
-    startIdx = getNearestPoint(trajectory, position)
-    progress = getProgress(trajectory, startIdx, position)
+def asTrajectory(trajectory):
+    return trajectory if isinstance(trajectory, Trajectory) else Trajectory(trajectory)
 
-    arcLength   = -progress
-    pointBehind = trajectory[0]
-    for i in range(1, len(trajectory)):
-        pointAhead = trajectory[i]
 
-        arcLength += distance(pointAhead, pointBehind)
-        if arcLength > args.lookahead_distance:
-            break
+def getNearestPoint(trajectory, position):
+    return asTrajectory(trajectory).nearestIndex(position)
 
-        pointBehind = pointAhead
 
-    # if look ahead is past the end of the trajectory
-    if np.array_equal(pointAhead, pointBehind): 
-        lookAheadPoint = pointAhead
+def getProgress(trajectory, currentIdx, position):
+    return asTrajectory(trajectory).progress(currentIdx, position)
 
-    else:
-        behindWeight = (arcLength - args.lookahead_distance) / distance(pointAhead, pointBehind)
-        aheadWeight = 1.0 - behindWeight
 
-        # sanity check
-        if not (0 <= aheadWeight <= 1 or 0 <= behindWeight <= 1):
-            raise Exception("Invalid Interpolation Weights")
+def pursuitVelocity(trajectory):
+    '''
+    Carrot following of a lookahead.
+
+    The three steps are:
+    1. Find the point on the path nearest to the drone as start of carrot
+    2. Find the arc length of the drone's progress along the trajectory
+    3. Interpolate the point lookahead_distance further along and chase it.
+    '''
+    trajectory = asTrajectory(trajectory)
+
+    position, _ = getPose()
+    startIdx = trajectory.nearestIndex(position)
+    progress = trajectory.progress(startIdx, position)
 
-        lookAheadPoint = aheadWeight * pointAhead + behindWeight * pointBehind
+    lookAheadPoint = trajectory.pointAtArcLength(progress + args.lookahead_distance)
 
     # Compute velocity to pursue lookahead point
     pursuitVector = lookAheadPoint - position
@@ -1057,32 +856,43 @@ def pursuitVelocity(trajectory):
     return pursuitVector
 
 
-def getLookAhead(path, t, position, lookAhead, dt=1e-4):
-    lookAheadPoint        = position  # TODO(cvorbach) increments always?
-    lookAheadDisplacement = 0
+def getLookAhead(path, t, position, lookAhead, iterations=8, tol=1e-3):
+    '''
+    Advances t to the point on the path lookAhead away from position.
 
-    while np.linalg.norm(lookAheadDisplacement) < lookAhead:
-        t += dt
+    Each step moves the carrot forward by the arc length it is short of
+    lookAhead. Moving the carrot ds along the path changes its distance to
+    position by at most ds, so the carrot never passes lookAhead, and a bounded
+    number of steps through the arc length table keeps the cost per tick
+    constant.
+    '''
+    s              = path.arcLengthAt(t)
+    lookAheadPoint = path(t)
 
-        if t < 1:
-            lookAheadDisplacement = lookAheadPoint - position
-            lookAheadPoint = path(t)
-        else:
-            t = 1
-            lookAheadPoint = path(t)
+    for _ in range(iterations):
+        shortfall = lookAhead - np.linalg.norm(lookAheadPoint - position)
+        if shortfall <= tol:
             break
+
+        s += shortfall
+        if s >= path.length:
             # TODO(cvorbach) unnecessary with extrapolation
-        
+            return 1, path(1.0)
+
+        t              = path.tAtArcLength(s)
+        lookAheadPoint = path(t)
+
     return t, lookAheadPoint
 
 
-def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=None, planningWrapper=None, planningKnots=None, recordingEndpoint=None, model=None):
-    position, _     = getPose()
+def followPath(path, lookAhead = PATH_LOOKAHEAD, marker=None, earlyStopDistance=None, planningWrapper=None, planningKnots=None, recordingEndpoint=None, model=None):
+    state           = getState(withTime=args.plot_debug) # the time is only read when plotting
+    position        = state.position
     t               = path.project(position) # find the new nearest path(t)
     lookAheadPoint  = path(t)
     reachedEnd      = False
 
-    lastPlotTime    = getTime()
+    lastPlotTime    = state.time
     markerPose      = airsim.Pose()
 
     planningThread  = None
@@ -1091,22 +901,59 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
     print('started following path')
 
     if args.plot_debug:
-        client.simPlotPoints([Vector3r(*path(t)) for t in np.linspace(0, 1, 1000)], color_rgba = [0.0, 0.0, 1.0, 1.0], duration = 60)
+        client.simPlotPoints([Vector3r(*p) for p in path(np.linspace(0, 1, 1000)).tolist()], color_rgba = [0.0, 0.0, 1.0, 1.0], duration = 60)
 
     if args.record and args.task != Task.HIKING:
         client.startRecording()
 
     endpointDirections = []
-    imagesBuffer       = np.zeros((1, args.seq_len, *IMAGE_SHAPE))
-    gpsBuffer          = np.zeros((1, args.seq_len, 3))
-    numBufferEntries   = 0
+    if model is not None:
+        model.reset()
+
+    pipeline = None
+    if model is not None and args.pipelined:
+        pipeline = startFlightPipeline()
+
+    def restartPlanning():
+        nonlocal planningThread
+
+        # only once the path is fit to the last plan
+        if planningThread is not None and (planningThread.is_alive() or np.any(planningKnots != path.knotPoints)):
+            return
+
+        planningThread = threading.Thread(target=planningWrapper, args=(planningKnots, state.position))
+        planningThread.start()
+
+    # lower priority work waits for slack time at a fixed rate
+    scheduler = None
+    if args.fixed_rate:
+        scheduler = FixedRateScheduler(args.control_period)
+        scheduler.addSlackTask('occupancies', lambda: updateOccupancies(occupancyMap))
+        if planningWrapper is not None:
+            scheduler.addSlackTask('replanning', restartPlanning)
+        if args.plot_debug and model is None:
+            scheduler.addSlackTask('plotting', lambda: tryPlotting(-float('inf'), occupancyMap, state.time), interval=args.plot_period)
 
     # control loop
     lastVelocity = None
     alpha        = 1.0
     while not reachedEnd:
-        position, orientation = getPose()
-        updateOccupancies(occupancyMap)
+        if scheduler is not None:
+            scheduler.wait()
+
+        # one snapshot of the pose for the whole tick
+        loopTimer.tick()
+        if pipeline is not None:
+            image, state = pipeline.latest() # the pose the frame was captured at
+            loopTimer.lap('capture')
+        else:
+            state = getState(withTime=args.plot_debug)
+            loopTimer.lap('pose')
+        position, orientation = state.position, state.orientation
+
+        if scheduler is None:
+            updateOccupancies(occupancyMap)
+            loopTimer.lap('occupancies')
 
         # handle planning thread if needed
         if planningWrapper is not None:
@@ -1117,17 +964,26 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
                 # update the spline path
                 if np.any(planningKnots != path.knotPoints):
                     path.fit(planningKnots.copy())
-                    t = path.project(position) # find the new nearest path(t)
+                    t = path.project(position, tHint=0.0) # the new plan starts where planning started, just behind the drone
 
                 # restart planning
-                planningThread = threading.Thread(target=planningWrapper, args=(planningKnots,))
-                planningThread.start()
+                if scheduler is None:
+                    restartPlanning()
 
-            planningThread.join(timeout=args.control_period)
+            # the pipeline is paced by frame capture and the scheduler by its deadlines instead
+            if scheduler is None:
+                planningThread.join(timeout=0 if pipeline is not None else args.control_period)
+            loopTimer.lap('planning')
+
+        # advance the pursuit point if needed
+        # TODO(cvorbach) move to its own thread
+        t, lookAheadPoint = getLookAhead(path, t, position, lookAhead)
+        lookAheadDisplacement = lookAheadPoint - position
+        loopTimer.lap('lookahead')
 
         # place marker if passed
         if marker is not None:
-            markerT, markerPosition = getLookAhead(path, t, position, lookAhead)
+            markerT, markerPosition = t, lookAheadPoint
 
            #  tangent  = normalize(path.tangent(markerT))
            #  normal   = normalize(np.cross(tangent, (0, 0, 1)))
@@ -1143,11 +999,8 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
            #  markerPose.orientation = Quaternionr(*markerOrientation.as_quat())
             markerPose.position    = Vector3r(*markerPosition)
             client.simSetObjectPose(marker, markerPose)
+            loopTimer.lap('marker')
 
-        # advance the pursuit point if needed
-        # TODO(cvorbach) move to its own thread
-        t, lookAheadPoint = getLookAhead(path, t, position, lookAhead)
-        lookAheadDisplacement = lookAheadPoint - position
         if t > 1:
             reachedEnd = True
             break
@@ -1173,17 +1026,20 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
             lastVelocity = velocity
 
             # plot
-            if args.plot_debug:
-                lastPlotTime = tryPlotting(lastPlotTime, occupancyMap)
+            if args.plot_debug and scheduler is None:
+                lastPlotTime = tryPlotting(lastPlotTime, occupancyMap, state.time)
 
             # record direction vector to endpoint if needed 
             if args.record and recordingEndpoint is not None:
                 endpointDirections.append((time.time(), *normalize(recordingEndpoint - position)))
 
-            # start control thread
-            if controlThread is not None:
+            # start control thread, at a fixed rate each command preempts the last as it ends
+            loopTimer.lap('pursuit')
+            if controlThread is not None and scheduler is None:
                 controlThread.join()
+            loopTimer.lap('control wait')
             controlThread = client.moveByVelocityAsync(float(velocity[0]), float(velocity[1]), float(velocity[2]), args.control_period, yaw_mode=YawMode(is_rate = False, yaw_or_rate = yawAngle))
+            loopTimer.lap('command')
 
         # If we are flying by a model
         else:
@@ -1193,12 +1049,9 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
                 client.simSetObjectPose(marker, markerPose)
 
             # get and format an image
-            image = None
-            while image is None or len(image) == 1:
-                image = client.simGetImages([airsim.ImageRequest('0', airsim.ImageType.Scene, False, False)])[0]
-                image = np.fromstring(image.image_data_uint8, dtype=np.uint8).astype(np.float32) / 255
-            image = np.reshape(image, IMAGE_SHAPE)
-            image = image[:, :, ::-1]                 # Required since order is BGR instead of RGB by default
+            if pipeline is None:
+                image = getImage()
+                loopTimer.lap('image')
 
             ## get gps
             #gpsDirection = normalize(recordingEndpoint - position)
@@ -1207,21 +1060,9 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
             #if args.record and recordingEndpoint is not None:
             #    endpointDirections.append((time.time(), *gpsDirection))
 
-            # add the image to the sliding window
-            if numBufferEntries < args.seq_len:
-                imagesBuffer[0, numBufferEntries] = image
-                # gpsBuffer[0, numBufferEntries]    = gpsDirection
-                numBufferEntries += 1
-            else:
-                imagesBuffer[0]     = np.roll(imagesBuffer[0], -1, axis=0)
-                imagesBuffer[0][-1] = image
-
-                # gpsBuffer[0]        = np.roll(gpsBuffer[0], -1, axis=0)
-                # gpsBuffer[0][-1]    = gpsDirection
-
-
-            # compute a velocity vector from the model
-            prediction = model.predict(imagesBuffer)[0][numBufferEntries-1]
+            # compute a velocity vector from the model on the sliding window ending at this image
+            prediction = model.step(image)
+            loopTimer.lap('inference')
             direction  = normalize(prediction)
             direction  = R.from_quat(orientation).apply(direction) # Transform from the drone camera's reference frame to static coordinates
             velocity   = args.speed * direction
@@ -1242,9 +1083,23 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
                 break
 
             # start control thread
-            if controlThread is not None:
-                controlThread.join()
-            controlThread = client.moveByVelocityAsync(float(velocity[0]), float(velocity[1]), float(velocity[2]), args.control_period, yaw_mode=YawMode(is_rate = False, yaw_or_rate = yawAngle))
+            loopTimer.lap('pursuit')
+            if pipeline is not None:
+                pipeline.send((velocity, yawAngle))
+            else:
+                if controlThread is not None and scheduler is None:
+                    controlThread.join()
+                loopTimer.lap('control wait')
+                controlThread = client.moveByVelocityAsync(float(velocity[0]), float(velocity[1]), float(velocity[2]), args.control_period, yaw_mode=YawMode(is_rate = False, yaw_or_rate = yawAngle))
+            loopTimer.lap('command')
+
+    loopTimer.endRun()
+    if scheduler is not None:
+        scheduler.printSummary()
+
+    if pipeline is not None:
+        pipeline.stop()
+        print(f'Pipeline dropped {pipeline.frames.dropped} stale frames and {pipeline.commands.dropped} stale commands')
 
     # hide the marker
     if marker is not None:
@@ -1262,18 +1117,39 @@ def followPath(path, lookAhead = 2, dt = 1e-4, marker=None, earlyStopDistance=No
             endpointFileWriter.writerows(endpointDirections)
 
 
+def makePlanner(endpoint, occupancyMap):
+    '''
+    Returns plan(position), giving path knots to endpoint with the selected planner
+    '''
+    if args.planner == Planner.ANYTIME:
+        planner = AnytimePlanner(endpoint, occupancyMap, initialEpsilon=args.initial_epsilon)
+
+        def plan(position):
+            path, bound, expansions = planner.plan(position, args.planning_budget * args.control_period)
+            print(f'anytime planning: suboptimality bound {bound:.2f}, {expansions} expansions')
+            return path
+        return plan
+
+    return lambda position: findPath(position, endpoint, occupancyMap)
+
+
 def moveToEndpoint(endpoint, occupancyMap, recordEndpointDirection=False, model=None):
     updateOccupancies(occupancyMap)
 
+    plan         = makePlanner(endpoint, occupancyMap)
     position, _  = getPose()
     print('first planning')
-    pathKnots    = findPath(position, endpoint, occupancyMap)
+    pathKnots    = plan(position)
+    while pathKnots is None: # the anytime planner may need several budgets for a first path
+        pathKnots = plan(position)
     print('finshed first planning')
     pathToEndpoint = Path(pathKnots.copy())
 
-    def planningWrapper(knots):
-        # run planning
-        newKnots = findPath(position, endpoint, occupancyMap)
+    def planningWrapper(knots, position):
+        # run planning from where the drone was when planning started
+        newKnots    = plan(position)
+        if newKnots is None:
+            return
 
         # replace the old knots
         knots.clear()
@@ -1291,78 +1167,151 @@ def moveToEndpoint(endpoint, occupancyMap, recordEndpointDirection=False, model=
     print('Reached Endpoint')
 
 
-def checkHalfSpace(testPoint, p):
+class Vehicle:
     '''
-    Checks that testPoint is in the half space defined by
-    point p and normal vector (p - x) / ||p - x||
-    where x is the current posistion of the drone
+    One of several vehicles flying the target task together. AirSim reports
+    each vehicle's pose and lidar relative to where it spawned, so each
+    vehicle keeps its own occupancy map, path and planner. stream is the
+    vehicle's row in the batched flight model.
     '''
-    
-    x, _ = getPose()
+    def __init__(self, name, stream):
+        self.name           = name
+        self.stream         = stream
+        self.occupancyMap   = VoxelOccupancyCache(args.voxel_size, args.cache_size, endpointTolerance=args.endpoint_tolerance, chunkSize=args.chunk_size)
+        self.endpoint       = None
+        self.plan           = None
+        self.path           = None
+        self.t              = 0
+        self.plannedKnots   = None
+        self.planningThread = None
+        self.controlThread  = None
+
+    def startRun(self, model=None):
+        '''
+        Picks a new target in view and plans a first path to it. Returns False
+        if no target was found, to try again next tick.
+        '''
+        if self.planningThread is not None:
+            self.planningThread.join() # don't let a plan to the last target replace the new path
 
-    return (testPoint - x).dot(normalize(p - x)) > np.linalg.norm(p - x)
+        updateOccupancies(self.occupancyMap, self.name)
 
+        client.rotateToYawAsync(random.random() * 2.0 * np.pi * RADIANS_2_DEGREES, vehicle_name=self.name).join()
+        self.endpoint = generateMazeTarget(self.occupancyMap, radius=args.near_task_radius, zLimit=(-5, -15), vehicleName=self.name)
+        if self.endpoint is None:
+            return False
 
-def checkBand(k, blazes, blazeStart, zLimit):
+        self.plan = makePlanner(self.endpoint, self.occupancyMap)
 
-    band = []
+        position, _ = getPose(self.name)
+        pathKnots   = self.plan(position)
+        while pathKnots is None: # the anytime planner may need several budgets for a first path
+            pathKnots = self.plan(position)
 
-    # check sides of each square of radius k between zLimits
-    for z in reversed(range(zLimit[0], zLimit[1])):
-        corners = np.array([
-            (blazeStart[0] - k, blazeStart[1] - k, z),
-            (blazeStart[0] + k, blazeStart[1] - k, z),
-            (blazeStart[0] + k, blazeStart[1] + k, z),
-            (blazeStart[0] - k, blazeStart[1] + k, z)
-        ])
+        self.path           = Path(pathKnots)
+        self.t              = self.path.project(position)
+        self.plannedKnots   = None
+        self.planningThread = None
 
-        tangentVectors = np.array([
-            (1, 0, 0),
-            (0, 1, 0),
-            (-1, 0, 0),
-            (0, -1, 0)
-        ])
+        if model is not None:
+            model.reset(self.stream)
+        return True
 
-        sideLength = 2*k-1
+    def planFrom(self, position):
+        self.plannedKnots = self.plan(position)
 
-        # check each side
-        for corner, tangent in zip(corners, tangentVectors):
-            for i in range(sideLength):
-                voxel = occupancyMap.point2Voxel(corner + i * tangent)
-                band.append(voxel)
+    def updatePath(self, position):
+        '''
+        Refits the path to the newest plan and starts planning again from position
+        '''
+        if self.planningThread is not None and self.planningThread.is_alive():
+            return
 
-                isOccupied    = voxel in occupancyMap
-                isSpacedOut   = not np.any([distance(np.array(b), voxel) < args.min_blaze_gap for b in blazes])
-                isInHalfSpace = checkHalfSpace(np.array(voxel), np.array(blazeStart))
+        if self.plannedKnots is not None:
+            self.path.fit(self.plannedKnots)
+            self.t            = self.path.project(position, tHint=0.0) # the plan starts where planning started
+            self.plannedKnots = None
 
-                if isOccupied and isSpacedOut and isInHalfSpace:
-                    return voxel
+        self.planningThread = threading.Thread(target=self.planFrom, args=(position,))
+        self.planningThread.start()
 
-    # client.simPlotPoints([Vector3r(*v) for v in band])
-    return None
 
+def flyVehicles(vehicles, model=None):
+    '''
+    Flies every vehicle to targets of its own, one after another, until
+    n_runs targets are reached between them. Each control tick the vehicles'
+    frames go through the model as one batch. Without a model the vehicles
+    pursue their paths, as when collecting data.
+    '''
+    vehiclesStarting = list(vehicles)
+    runsCompleted    = 0
+    framesInferred   = 0
+    startTime        = time.perf_counter()
 
-def generateHikingBlazes(start, occupancyMap, numBlazes = 2, zLimit=(-15, -1), maxSearchDepth=50):
-    blazes = []
-    blazeStart = occupancyMap.point2Voxel(start)
+    if args.record:
+        client.startRecording()
 
-    # lastPlotTime = tryPlotting(-float('inf'), occupancyMap)
+    while runsCompleted < args.n_runs:
+        loopTimer.tick()
+        vehiclesStarting = [vehicle for vehicle in vehiclesStarting if not vehicle.startRun(model)]
+        flying = [vehicle for vehicle in vehicles if vehicle not in vehiclesStarting]
+        loopTimer.lap('start runs')
+        if len(flying) == 0:
+            continue
 
-    for _ in range(numBlazes):
-        nextBlaze   = None
-        
-        k = 5
-        while nextBlaze is None and k < maxSearchDepth: 
-            nextBlaze = checkBand(k, blazes, blazeStart, zLimit)
-            k += 1
+        poses = [getPose(vehicle.name) for vehicle in vehicles]
+        loopTimer.lap('pose')
+
+        # every vehicle's frame through the model at once, vehicles still starting are ignored
+        if model is not None:
+            images      = np.stack([getImage(vehicleName=vehicle.name) for vehicle in vehicles])
+            loopTimer.lap('image')
+            predictions = model.stepBatch(images)
+            framesInferred += len(flying)
+            loopTimer.lap('inference')
+
+        for vehicle in flying:
+            position, orientation = poses[vehicle.stream]
+            updateOccupancies(vehicle.occupancyMap, vehicle.name)
+            loopTimer.lap('occupancies')
+            vehicle.updatePath(position)
+            loopTimer.lap('planning')
+
+            vehicle.t, lookAheadPoint = getLookAhead(vehicle.path, vehicle.t, position, PATH_LOOKAHEAD)
+            lookAheadDisplacement = lookAheadPoint - position
+            endpointDisplacement  = vehicle.path(1.0) - position
+            loopTimer.lap('lookahead')
+
+            if vehicle.t > 1 or np.linalg.norm(endpointDisplacement) < args.endpoint_tolerance:
+                runsCompleted += 1
+                vehiclesStarting.append(vehicle)
+                print(f'{vehicle.name} reached its endpoint, {runsCompleted}/{args.n_runs} runs')
+                continue
+
+            if model is not None:
+                direction = R.from_quat(orientation).apply(normalize(predictions[vehicle.stream])) # camera frame to static coordinates
+                velocity  = args.speed * direction
+                yawAngle  = np.arctan2(lookAheadDisplacement[1], lookAheadDisplacement[0]) * RADIANS_2_DEGREES
+            else:
+                velocity  = args.speed * normalize(lookAheadDisplacement)
+                yawAngle  = np.arctan2(endpointDisplacement[1], endpointDisplacement[0]) * RADIANS_2_DEGREES
+
+            loopTimer.lap('pursuit')
+            if vehicle.controlThread is not None:
+                vehicle.controlThread.join()
+            loopTimer.lap('control wait')
+            vehicle.controlThread = client.moveByVelocityAsync(float(velocity[0]), float(velocity[1]), float(velocity[2]), args.control_period, yaw_mode=YawMode(is_rate = False, yaw_or_rate = yawAngle), vehicle_name=vehicle.name)
+            loopTimer.lap('command')
 
-        if k == maxSearchDepth:
-            raise Exception('Could not find a tree to blaze')
+    loopTimer.endRun()
 
-        blazes.append(nextBlaze)
-        blazeStart = blazes[-1]
+    if args.record:
+        client.stopRecording()
 
-    return blazes
+    elapsed = time.perf_counter() - startTime
+    print(f'{runsCompleted} runs by {len(vehicles)} vehicles in {elapsed:.1f}s, {runsCompleted / elapsed:.2f} runs/s')
+    if model is not None:
+        print(f'{framesInferred} frames inferred in batches of {model.batchSize}, {framesInferred / elapsed:.1f} frames/s')
 
 
 # -----------------------------
@@ -1370,12 +1319,20 @@ def generateHikingBlazes(start, occupancyMap, numBlazes = 2, zLimit=(-15, -1), m
 # -----------------------------
 
 # Takeoff
-client.armDisarm(True)
-client.takeoffAsync().join()
-client.moveToZAsync(-10, 1).join()
+for vehicleName in vehicleNames:
+    client.armDisarm(True, vehicleName)
+    client.takeoffAsync(vehicle_name=vehicleName).join()
+    client.moveToZAsync(-10, 1, vehicle_name=vehicleName).join()
 print("Taken off")
 
-occupancyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size)
+# Several vehicles fly the target task together
+if len(vehicleNames) > 1:
+    flyVehicles([Vehicle(name, i) for i, name in enumerate(vehicleNames)], model=flightModel)
+    loopTimer.close()
+    printRpcCounts()
+    sys.exit()
+
+occupancyMap = VoxelOccupancyCache(args.voxel_size, args.cache_size, endpointTolerance=args.endpoint_tolerance, chunkSize=args.chunk_size)
 
 # get the markers
 markers = client.simListSceneObjects('Red_Cube.*') 
@@ -1424,7 +1381,7 @@ for i in range(args.n_runs):
         print('updated occupancies')
 
         # TODO(cvorbach) Online path construction with collision checking along each spline length
-        walk = randomWalk(position, stepSize=5, occupancyMap=occupancyMap)
+        walk = randomWalk(position, stepSize=5, pathLength=args.walk_length, occupancyMap=occupancyMap)
         path = Path(walk)
         # path = ExtendablePath(walk)
 
@@ -1450,7 +1407,7 @@ for i in range(args.n_runs):
         print('reached z-level')
 
         print('getting blazes')
-        hikingBlazes = generateHikingBlazes(position, occupancyMap, zLimit=zLimit)
+        hikingBlazes = generateHikingBlazes(position, occupancyMap, getPose()[0], args.min_blaze_gap, zLimit=zLimit)
         turnTowardEndpoint(hikingBlazes[0], timeout=10)
         print('Got blazes')
 
@@ -1496,4 +1453,6 @@ for i in range(args.n_runs):
         moveToEndpoint(endpoint, occupancyMap, recordEndpointDirection=True, model=flightModel)
 
 
-print('Finished Data Runs')
\ No newline at end of file
+loopTimer.close()
+print('Finished Data Runs')
+printRpcCounts()
\ No newline at end of file
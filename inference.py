@@ -0,0 +1,317 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+Streaming inference for the flight models.
+
+The flight models run a per frame conv head into a recurrent layer over a
+sliding window of seq_len frames. Rerunning the whole window through
+model.predict every control tick repeats the conv head on every frame in
+the window, so StreamingModel splits the model at its recurrent layer and
+keeps the per frame features (and optionally the recurrent state) between
+ticks. A batch of independent streams, e.g. one per vehicle, runs through
+the model together, each with its own frames and recurrent state.
+'''
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+
+class InferenceMode:
+    PREDICT  = 'predict'  # the whole window through the model every tick
+    WINDOWED = 'windowed' # cached conv features, recurrent layer rerun over the window. Same output as predict
+    STATEFUL = 'stateful' # cached recurrent state, one cell step per tick. Remembers past the window
+
+
+class InferenceBackend:
+    KERAS    = 'keras'    # model.predict
+    FUNCTION = 'function' # tf.function traced once for the fixed input signature
+    TFLITE   = 'tflite'   # TFLite interpreter, which runs float models with the XNNPACK CPU delegate
+
+
+def compileModel(model, backend, numThreads=None, batchSize=1):
+    '''
+    Returns a function running model on one numpy batch of batchSize shaped
+    like its (fixed) input, in the input's dtype, and returning numpy outputs
+    '''
+    if backend == InferenceBackend.KERAS:
+        return model.predict
+
+    inputShape = (batchSize, *model.input_shape[1:])
+    inputDtype = model.inputs[0].dtype
+    function   = tf.function(lambda x: model(x, training=False), input_signature=[tf.TensorSpec(shape=inputShape, dtype=inputDtype)])
+    concrete   = function.get_concrete_function() # trace now instead of on the first control tick
+
+    if backend == InferenceBackend.FUNCTION:
+        return lambda x: function(tf.convert_to_tensor(x, dtype=inputDtype)).numpy()
+
+    if backend == InferenceBackend.TFLITE:
+        # without the model as trackable object the weights are frozen into the graph, Keras 3 variables
+        # aren't tracked the way the converter expects and come out unset
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete])
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS] # recurrent cells may need tf ops
+        return tfliteFunction(converter.convert(), numThreads)
+
+    raise ValueError(f'Unknown inference backend: {backend}')
+
+
+def tfliteFunction(modelContent, numThreads=None, batchSize=None):
+    '''
+    Runs a TFLite model, resized to batchSize if given
+    '''
+    interpreter = tf.lite.Interpreter(model_content=modelContent, num_threads=numThreads)
+
+    inputDetails = interpreter.get_input_details()[0]
+    if batchSize is not None and inputDetails['shape'][0] != batchSize:
+        interpreter.resize_tensor_input(inputDetails['index'], (batchSize, *inputDetails['shape'][1:]))
+    interpreter.allocate_tensors()
+
+    inputDetails  = interpreter.get_input_details()[0]
+    outputDetails = interpreter.get_output_details()[0]
+
+    def run(x):
+        interpreter.reset_all_variables() # fused recurrent ops keep their state between invokes
+        interpreter.set_tensor(inputDetails['index'], np.asarray(x, dtype=inputDetails['dtype']))
+        interpreter.invoke()
+        return interpreter.get_tensor(outputDetails['index'])
+
+    return run
+
+
+def splitModel(model, batchSize=1):
+    '''
+    Rebuilds a single input flight model around its own (weight sharing)
+    layers as a head running one frame at a time up to the recurrent layer,
+    the recurrent layer and a tail applied to one recurrent output at a time,
+    each on batches of batchSize. The recurrent layer and tail are None when
+    the model has none.
+    '''
+    if len(model.inputs) != 1:
+        raise ValueError('Streaming inference only supports single input models')
+
+    layers   = [layer for layer in model.layers if not isinstance(layer, keras.layers.InputLayer)]
+    rnnIndex = next((i for i, layer in enumerate(layers) if isinstance(layer, keras.layers.RNN)), len(layers))
+
+    frameInput = keras.Input(batch_size=batchSize, shape=(1, *model.input_shape[2:]), dtype=model.inputs[0].dtype)
+    features   = frameInput
+    for layer in layers[:rnnIndex]:
+        features = layer(features)
+    head = keras.models.Model(frameInput, features)
+
+    if rnnIndex == len(layers):
+        return head, None, None
+
+    rnnLayer = layers[rnnIndex]
+    if rnnIndex + 1 == len(layers):
+        return head, rnnLayer, None
+
+    # sizes come from symbolic tensors, Keras 3 layers have no output_shape
+    stepInput = keras.Input(batch_size=batchSize, shape=(1, rnnLayer(features).shape[-1]))
+    output    = stepInput
+    for layer in layers[rnnIndex+1:]:
+        output = layer(output)
+
+    return head, rnnLayer, keras.models.Model(stepInput, output)
+
+
+class FrameBuffer:
+    '''
+    Ring of the last capacity frames. Frames are written in place and only
+    put in order (oldest first, zero padded until the ring fills) on demand.
+    '''
+    def __init__(self, capacity, frameShape, dtype=np.float32):
+        self.capacity = capacity
+        self.frames   = np.zeros((capacity, *frameShape), dtype=dtype)
+        self.staging  = None
+        self.count    = 0
+
+    def append(self, frame):
+        self.frames[self.count % self.capacity] = frame
+        self.count += 1
+
+    def window(self):
+        '''
+        Returns the frames in order. This is the ring itself until it wraps,
+        after that the two halves are copied once into a staging array.
+        '''
+        split = self.count % self.capacity
+        if self.count <= self.capacity or split == 0:
+            return self.frames
+
+        if self.staging is None:
+            self.staging = np.empty_like(self.frames)
+
+        n = self.capacity - split
+        self.staging[:n] = self.frames[split:]
+        self.staging[n:] = self.frames[:split]
+        return self.staging
+
+    def clear(self):
+        self.frames.fill(0) # the window is zero padded until it fills
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+
+class StreamingModel:
+    '''
+    Streams frames through a flight model batchSize streams at a time, e.g.
+    one per vehicle. Each stream keeps its own frames and recurrent state and
+    can be reset on its own.
+    '''
+    def __init__(self, model, seqLen, mode=InferenceMode.WINDOWED, backend=InferenceBackend.FUNCTION, numThreads=None, quantizedHead=None, validate=False, atol=1e-4, batchSize=1):
+        self.model         = model
+        self.seqLen        = seqLen
+        self.mode          = mode
+        self.backend       = backend
+        self.numThreads    = numThreads
+        self.quantizedHead = quantizedHead
+        self.validate      = validate
+        self.atol          = atol
+        self.batchSize     = batchSize
+
+        if mode not in (InferenceMode.PREDICT, InferenceMode.WINDOWED, InferenceMode.STATEFUL):
+            raise ValueError(f'Unknown inference mode: {mode}')
+
+        if mode == InferenceMode.PREDICT and quantizedHead is not None:
+            raise ValueError('A quantized head needs a streaming inference mode')
+
+        if mode == InferenceMode.PREDICT:
+            self.runModel = compileModel(model, backend, numThreads, batchSize)
+        else:
+            self.split()
+
+        if mode == InferenceMode.PREDICT or validate:
+            imageDtype  = tf.as_dtype(self.model.inputs[0].dtype).as_numpy_dtype # a string under Keras 3
+            self.images = [FrameBuffer(seqLen, self.model.input_shape[2:], dtype=imageDtype) for _ in range(batchSize)]
+
+        if mode == InferenceMode.WINDOWED and self.rnnLayer is not None:
+            self.features = [FrameBuffer(seqLen, (self.featureSize,)) for _ in range(batchSize)]
+
+        self.numFrames = np.zeros(batchSize, dtype=int)
+        self.reset()
+
+    def split(self):
+        '''
+        Splits the model with splitModel. The head and tail go through the
+        inference backend (or the head is a quantized TFLite model), the
+        recurrent layer always runs as a tf.function since custom cells
+        don't all convert to TFLite.
+        '''
+        head, self.rnnLayer, tail = splitModel(self.model, self.batchSize)
+        self.featureSize = head.outputs[0].shape[-1]
+
+        if self.quantizedHead is not None:
+            with open(self.quantizedHead, 'rb') as f:
+                self.head = tfliteFunction(f.read(), self.numThreads, self.batchSize)
+        else:
+            self.head = compileModel(head, self.backend, self.numThreads, self.batchSize)
+
+        # models without recurrence (cnn) are entirely head
+        if self.rnnLayer is None:
+            return
+
+        # the tail maps each recurrent output to the model output (ncp outputs directly)
+        self.tail = np.asarray if tail is None else compileModel(tail, self.backend, self.numThreads, self.batchSize)
+
+        self.stateSizes = tf.nest.flatten(self.rnnLayer.cell.state_size)
+
+        # each stream's output at its newest frame, later (padding) frames don't affect it
+        self.runWindow = tf.function(
+            lambda windows, newest: tf.gather(self.rnnLayer(windows), newest, batch_dims=1)[:, tf.newaxis],
+            input_signature=[
+                tf.TensorSpec(shape=(self.batchSize, None, self.featureSize), dtype=tf.float32),
+                tf.TensorSpec(shape=(self.batchSize,), dtype=tf.int32)])
+
+        self.runStep = tf.function(self.cellStep)
+
+    def cellStep(self, features, states):
+        output, states = self.rnnLayer.cell(features, states)
+        return output[:, tf.newaxis], tf.nest.flatten(states)
+
+    def reset(self, stream=None):
+        '''
+        Forget every frame of one stream, or of all of them, as at the start of a new path
+        '''
+        streams = range(self.batchSize) if stream is None else [stream]
+
+        for i in streams:
+            self.numFrames[i] = 0
+
+            if self.mode == InferenceMode.PREDICT or self.validate:
+                self.images[i].clear()
+
+            if self.mode == InferenceMode.WINDOWED and self.rnnLayer is not None:
+                self.features[i].clear()
+
+        if self.mode == InferenceMode.STATEFUL and self.rnnLayer is not None:
+            if stream is None:
+                self.states = [tf.zeros((self.batchSize, size)) for size in self.stateSizes]
+            else:
+                self.states = [tf.tensor_scatter_nd_update(state, [[stream]], tf.zeros((1, size))) for state, size in zip(self.states, self.stateSizes)]
+
+    @staticmethod
+    def stackWindows(buffers):
+        '''
+        Each stream's window, zero padded after its newest frame, and the index of its newest frame
+        '''
+        if len(buffers) == 1:
+            windows = buffers[0].window()[np.newaxis]
+        else:
+            windows = np.stack([buffer.window() for buffer in buffers])
+
+        return windows, np.array([len(buffer) - 1 for buffer in buffers], dtype=np.int32)
+
+    def predictWindows(self, images, runModel):
+        '''
+        The original inference: each stream's whole zero padded sliding window through the model
+        '''
+        for buffer, image in zip(self.images, images):
+            buffer.append(image)
+
+        windows, newest = self.stackWindows(self.images)
+        return np.asarray(runModel(windows))[np.arange(self.batchSize), newest]
+
+    def step(self, image):
+        '''
+        Adds the newest frame of a single stream model and returns the model output for it
+        '''
+        return self.stepBatch(image[np.newaxis])[0]
+
+    def stepBatch(self, images):
+        '''
+        Adds the newest frame of every stream, stacked along the first axis,
+        and returns the model output for each
+        '''
+        if self.mode == InferenceMode.PREDICT:
+            predictions = self.predictWindows(images, self.runModel)
+            self.numFrames += 1
+            return predictions
+
+        features = self.head(images[:, np.newaxis])
+
+        if self.rnnLayer is None:
+            output = features
+
+        elif self.mode == InferenceMode.WINDOWED:
+            for buffer, frameFeatures in zip(self.features, features[:, 0]):
+                buffer.append(frameFeatures)
+            windows, newest = self.stackWindows(self.features)
+            output = self.tail(self.runWindow(windows[:, :newest.max()+1], newest))
+
+        else:
+            output, self.states = self.runStep(features[:, 0], self.states)
+            output = self.tail(output)
+
+        predictions = np.asarray(output)[:, -1]
+
+        # the stateful model only agrees with the window until the window starts sliding
+        if self.validate:
+            expected = self.predictWindows(images, self.model.predict)
+            checked  = self.numFrames < self.seqLen if self.mode == InferenceMode.STATEFUL else np.full(self.batchSize, True)
+            if np.any(checked):
+                error = np.max(np.abs(predictions[checked] - expected[checked]))
+                if error > self.atol:
+                    raise ValueError(f'Streaming inference differs from model.predict by {error} on frames {self.numFrames[checked]}')
+
+        self.numFrames += 1
+        return predictions
@@ -0,0 +1,275 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+A local stand in for airsim.MultirotorClient.
+
+MockWorld simulates any number of vehicles kinematically in a forest of
+tree trunks. Every MockMultirotorClient connected to a world sees the same
+vehicles, like separate rpc connections to one simulator. Only the calls
+flight.py and benchmark.py make are implemented. As in AirSim, poses and
+lidar points are in each vehicle's own frame relative to where it spawned.
+
+Unless realtime is set the world runs on a virtual clock that joining a
+command advances to the command's end, so flights run as fast as the
+client code allows. The world counts every call made to it by name in
+rpcCounts.
+'''
+import collections
+import functools
+import re
+import time
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+IMAGE_SHAPE = (256,256,3)
+
+
+class MockVector:
+    def __init__(self, values):
+        self.values = np.array(values, dtype=float)
+
+    def to_numpy_array(self):
+        return self.values.copy()
+
+
+class MockPose:
+    def __init__(self, position, orientation):
+        self.position    = MockVector(position)
+        self.orientation = MockVector(orientation) # x, y, z, w like airsim.Quaternionr
+
+
+class MockImageResponse:
+    def __init__(self, image):
+        self.height, self.width = image.shape[:2]
+        self.image_data_uint8   = image.tobytes()
+
+
+class MockLidarData:
+    def __init__(self, points, timestamp):
+        self.point_cloud = points.flatten().tolist()
+        self.time_stamp  = timestamp
+
+
+class MockKinematics:
+    def __init__(self, position, orientation):
+        self.position    = MockVector(position)
+        self.orientation = MockVector(orientation)
+
+
+class MockMultirotorState:
+    def __init__(self, timestamp, position, orientation):
+        self.timestamp            = timestamp
+        self.kinematics_estimated = MockKinematics(position, orientation)
+
+
+class MockFuture:
+    '''
+    Like the msgpack future airsim returns, join waits until the command ends
+    '''
+    def __init__(self, world, endTime):
+        self.world   = world
+        self.endTime = endTime
+
+    def join(self):
+        self.world.waitUntil(self.endTime)
+
+
+class MockVehicle:
+    def __init__(self, name, spawn):
+        self.name        = name
+        self.spawn       = np.array(spawn, dtype=float) # world position of the vehicle's origin
+        self.position    = np.zeros(3)
+        self.velocity    = np.zeros(3)
+        self.yaw         = 0.0
+        self.commandEnd  = 0.0
+        self.updateTime  = 0.0
+
+    def advance(self, now):
+        '''
+        Integrates the commanded velocity up to now, hovering once the command ends
+        '''
+        elapsed = max(0.0, min(now, self.commandEnd) - self.updateTime)
+        self.position  += elapsed * self.velocity
+        self.updateTime = now
+
+    def orientation(self):
+        return R.from_euler('z', self.yaw).as_quat()
+
+
+class MockWorld:
+    def __init__(self, numVehicles=1, spacing=10.0, numTrees=400, extent=200.0, lidarRange=50.0, realtime=False, seed=0):
+        rng = np.random.default_rng(seed)
+
+        self.realtime    = realtime
+        self.lidarRange  = lidarRange
+        self.virtualTime = 0.0
+        self.startTime   = time.time()
+
+        self.vehicles = {}
+        for i in range(numVehicles):
+            name = f'Drone{i+1}'
+            self.vehicles[name] = MockVehicle(name, (0, i * spacing, 0))
+
+        # trunks as vertical lines of lidar returns a meter apart, clear of the spawn points
+        trunks = rng.uniform(-extent / 2, extent / 2, size=(numTrees, 2))
+        trunks = trunks[np.abs(trunks[:, 0]) > 5]
+        heights = rng.integers(5, 20, size=len(trunks))
+        self.treePoints = np.array([(x, y, -z) for (x, y), h in zip(trunks, heights) for z in range(h)], dtype=np.float32)
+
+        # a wide texture the camera pans across as the vehicle yaws
+        self.texture = rng.integers(0, 256, size=(IMAGE_SHAPE[0], 4 * IMAGE_SHAPE[1], IMAGE_SHAPE[2]), dtype=np.uint8)
+
+        self.sceneObjects = {name: None for name in ('Red_Cube_0', 'Red_Cube_1', 'Red_Cube_2', 'QuadcopterLeader_0')}
+
+        self.rpcCounts = collections.Counter()
+
+    def now(self):
+        if self.realtime:
+            return time.time() - self.startTime
+        return self.virtualTime
+
+    def waitUntil(self, endTime):
+        if self.realtime:
+            time.sleep(max(0.0, endTime - self.now()))
+        else:
+            self.virtualTime = max(self.virtualTime, endTime)
+
+    def vehicle(self, name):
+        '''
+        The named vehicle, the first vehicle for the default name ''
+        '''
+        if name == '':
+            name = next(iter(self.vehicles))
+        vehicle = self.vehicles[name]
+        vehicle.advance(self.now())
+        return vehicle
+
+
+def rpc(method):
+    '''
+    Counts calls to a client method in its world
+    '''
+    @functools.wraps(method)
+    def counted(self, *args, **kwargs):
+        self.world.rpcCounts[method.__name__] += 1
+        return method(self, *args, **kwargs)
+    return counted
+
+
+class MockMultirotorClient:
+    def __init__(self, world):
+        self.world = world
+
+    # Connection and setup
+
+    @rpc
+    def confirmConnection(self):
+        print('Connected to mock world with', len(self.world.vehicles), 'vehicles')
+
+    @rpc
+    def listVehicles(self):
+        return list(self.world.vehicles)
+
+    @rpc
+    def enableApiControl(self, is_enabled, vehicle_name=''):
+        self.world.vehicle(vehicle_name)
+
+    @rpc
+    def armDisarm(self, arm, vehicle_name=''):
+        self.world.vehicle(vehicle_name)
+        return True
+
+    @rpc
+    def simEnableWeather(self, enable):
+        pass
+
+    @rpc
+    def simSetWeatherParameter(self, param, val):
+        pass
+
+    @rpc
+    def startRecording(self):
+        pass
+
+    @rpc
+    def stopRecording(self):
+        pass
+
+    # Scene objects
+
+    @rpc
+    def simListSceneObjects(self, name_regex='.*'):
+        return [name for name in self.world.sceneObjects if re.match(name_regex, name)]
+
+    @rpc
+    def simSetObjectPose(self, object_name, pose, teleport=True):
+        self.world.sceneObjects[object_name] = pose
+        return True
+
+    @rpc
+    def simPlotPoints(self, points, color_rgba=[1.0, 0.0, 0.0, 1.0], size=10.0, duration=-1.0, is_persistent=False):
+        pass
+
+    # Movement
+
+    @rpc
+    def takeoffAsync(self, timeout_sec=20, vehicle_name=''):
+        return self.moveToZAsync(-3, 1, vehicle_name=vehicle_name)
+
+    @rpc
+    def moveToZAsync(self, z, velocity, timeout_sec=3e+38, yaw_mode=None, lookahead=-1, adaptive_lookahead=1, vehicle_name=''):
+        vehicle = self.world.vehicle(vehicle_name)
+        now     = self.world.now()
+
+        duration = abs(z - vehicle.position[2]) / velocity
+
+        vehicle.velocity    = np.zeros(3)
+        vehicle.position[2] = z
+        vehicle.commandEnd  = now
+        return MockFuture(self.world, now + duration)
+
+    @rpc
+    def rotateToYawAsync(self, yaw, timeout_sec=3e+38, margin=5, vehicle_name=''):
+        vehicle     = self.world.vehicle(vehicle_name)
+        vehicle.yaw = np.radians(yaw)
+        return MockFuture(self.world, self.world.now())
+
+    @rpc
+    def moveByVelocityAsync(self, vx, vy, vz, duration, drivetrain=None, yaw_mode=None, vehicle_name=''):
+        vehicle = self.world.vehicle(vehicle_name)
+        now     = self.world.now()
+
+        vehicle.velocity   = np.array([vx, vy, vz], dtype=float)
+        vehicle.commandEnd = now + duration
+        if yaw_mode is not None and not yaw_mode.is_rate:
+            vehicle.yaw = np.radians(yaw_mode.yaw_or_rate)
+        return MockFuture(self.world, now + duration)
+
+    # Sensing
+
+    @rpc
+    def getMultirotorState(self, vehicle_name=''):
+        vehicle = self.world.vehicle(vehicle_name)
+        return MockMultirotorState(int(1e9 * self.world.now()), vehicle.position, vehicle.orientation())
+
+    @rpc
+    def simGetVehiclePose(self, vehicle_name=''):
+        vehicle = self.world.vehicle(vehicle_name)
+        return MockPose(vehicle.position, vehicle.orientation())
+
+    @rpc
+    def simGetImages(self, requests, vehicle_name=''):
+        vehicle = self.world.vehicle(vehicle_name)
+
+        width  = self.world.texture.shape[1] - IMAGE_SHAPE[1]
+        column = int(width * (vehicle.yaw / (2 * np.pi) % 1))
+        image  = self.world.texture[:, column:column + IMAGE_SHAPE[1]]
+        return [MockImageResponse(image) for _ in requests]
+
+    @rpc
+    def getLidarData(self, lidar_name='', vehicle_name=''):
+        vehicle = self.world.vehicle(vehicle_name)
+
+        offsets = self.world.treePoints - (vehicle.spawn + vehicle.position)
+        inRange = np.einsum('ij,ij->i', offsets[:, :2], offsets[:, :2]) < self.world.lidarRange**2
+        return MockLidarData(self.world.treePoints[inRange] - vehicle.spawn, int(1e9 * self.world.now()))
@@ -54,8 +54,9 @@ strides = [
     (1,1),
 ]
 
-inputs = keras.Input(batch_size = BATCH_SIZE, shape = (SEQUENCE_LENGTH, *IMAGE_SHAPE))
-c1 = keras.layers.Conv2D(filters=24, kernel_size=kernels[0], strides=strides[0], activation='relu')(inputs)
+inputs = keras.Input(batch_size = BATCH_SIZE, shape = (SEQUENCE_LENGTH, *IMAGE_SHAPE), dtype='uint8')
+scaled = keras.layers.Rescaling(1 / 255)(inputs) # uint8 RGB images to [0, 1]
+c1 = keras.layers.Conv2D(filters=24, kernel_size=kernels[0], strides=strides[0], activation='relu')(scaled)
 c2 = keras.layers.Conv2D(filters=36, kernel_size=kernels[1], strides=strides[1], activation='relu')(c1)
 c3 = keras.layers.Conv2D(filters=48, kernel_size=kernels[2], strides=strides[2], activation='relu')(c2)
 c4 = keras.layers.Conv2D(filters=64, kernel_size=kernels[3], strides=strides[3], activation='relu')(c3)
@@ -79,16 +80,16 @@ model.summary()
 
 # Load images
 imageFiles = os.listdir(MODEL_RECORDING_DIRECTORY)
-images = np.zeros((len(imageFiles), *IMAGE_SHAPE))
+images = np.zeros((len(imageFiles), *IMAGE_SHAPE), dtype=np.uint8)
 for i, imageFile in enumerate(imageFiles):
     try:
-        image = np.array(PIL.Image.open(MODEL_RECORDING_DIRECTORY + '\\' + imageFile).convert('RGB'), dtype=np.float32) / 255
+        image = np.asarray(PIL.Image.open(MODEL_RECORDING_DIRECTORY + '\\' + imageFile).convert('RGB'))
     except PIL.UnidentifiedImageError:
         raise Exception("Image: ", MODEL_RECORDING_DIRECTORY, "\\", imageFile, " is corrupt.")
 
     images[i] = image
 
-batch = np.zeros((BATCH_SIZE, SEQUENCE_LENGTH, *IMAGE_SHAPE))
+batch = np.zeros((BATCH_SIZE, SEQUENCE_LENGTH, *IMAGE_SHAPE), dtype=np.uint8)
 k = 0
 vectors = []
 activations = []
@@ -0,0 +1,212 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+Flight model architectures.
+
+Each architecture is registered by model name and by whether it takes the
+GPS direction as a second input, and is only built (and tensorflow only
+imported) when it is asked for.
+
+Models take uint8 images straight from the camera or disk. Channel order
+and rescaling to [0, 1] are the first layers of the model, so neither has
+to be done frame by frame in numpy.
+'''
+import sys
+
+import numpy as np
+
+IMAGE_SHAPE = (256,256,3)
+
+RECURRENT_MODELS = ('lstm', 'rnn', 'gru', 'ctgru', 'odernn')
+
+
+class ChannelOrder:
+    RGB = 'rgb' # PIL images and processed data
+    BGR = 'bgr' # airsim camera images
+
+
+def residentMemory():
+    '''
+    Returns the peak resident memory of this process in MB or None if the platform can't report it
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10 # bytes on macOS, KB on linux
+
+
+def uint8Images(images):
+    '''
+    Returns images as uint8, converting data processed as float in [0, 1]
+    '''
+    images = np.asarray(images)
+    if images.dtype == np.uint8:
+        return images
+    return np.round(np.clip(images, 0, 1) * 255).astype(np.uint8)
+
+
+def imagePreprocessing(imageInput, channelOrder):
+    '''
+    uint8 images in the given channel order to float RGB in [0, 1]. Neither
+    layer has weights so checkpoints load the same with or without them.
+    '''
+    from tensorflow import keras
+
+    x = imageInput
+    if channelOrder == ChannelOrder.BGR:
+        x = keras.layers.Lambda(lambda images: images[..., ::-1], name='bgr_to_rgb')(x)
+    elif channelOrder != ChannelOrder.RGB:
+        raise ValueError(f"Unsupported channel order: {channelOrder}")
+    return keras.layers.Rescaling(1 / 255, name='rescale_image')(x)
+
+
+def ncpCell():
+    import kerasncp as kncp
+
+    wiring = kncp.wirings.NCP(
+        inter_neurons=12,   # Number of inter neurons
+        command_neurons=32,  # Number of command neurons
+        motor_neurons=3,    # Number of motor neurons
+        sensory_fanout=4,   # How many outgoing synapses has each sensory neuron
+        inter_fanout=4,     # How many outgoing synapses has each inter neuron
+        recurrent_command_synapses=4,   # Now many recurrent synapses are in the
+                                        # command neuron layer
+        motor_fanin=6,      # How many incoming syanpses has each motor neuron
+    )
+
+    return kncp.LTCCell(wiring)
+
+
+def recurrentLayer(modelName, rnnSize):
+    from tensorflow import keras
+
+    if modelName == 'lstm':
+        return keras.layers.LSTM(units=rnnSize, return_sequences=True)
+    elif modelName == 'rnn':
+        return keras.layers.SimpleRNN(units=rnnSize, return_sequences=True)
+    elif modelName == 'gru':
+        return keras.layers.GRU(units=rnnSize, return_sequences=True)
+    elif modelName == 'ctgru':
+        from node_cell import CTGRU
+        return keras.layers.RNN(CTGRU(units=rnnSize), return_sequences=True)
+    elif modelName == 'odernn':
+        from node_cell import CTRNNCell
+        return keras.layers.RNN(CTRNNCell(units=rnnSize, method='dopri5'), return_sequences=True)
+    else:
+        raise ValueError(f"Unsupported model type: {modelName}")
+
+
+def convHead(seqLen, channelOrder):
+    '''
+    The per frame convolutional head every flight model shares.
+    Returns the uint8 image input, the flattened conv features after dropout and the frame features.
+    '''
+    from tensorflow import keras
+
+    imageInput = keras.Input(shape=(seqLen, *IMAGE_SHAPE), dtype='uint8')
+    x = imagePreprocessing(imageInput, channelOrder)
+    x = keras.layers.TimeDistributed(keras.layers.Conv2D(filters=16, kernel_size=(5,5), strides=(3,3), activation='relu'))(x)
+    x = keras.layers.TimeDistributed(keras.layers.Conv2D(filters=32, kernel_size=(3,3), strides=(2,2), activation='relu'))(x)
+    x = keras.layers.TimeDistributed(keras.layers.Conv2D(filters=64, kernel_size=(2,2), strides=(2,2), activation='relu'))(x)
+    x = keras.layers.TimeDistributed(keras.layers.Conv2D(filters=8, kernel_size=(2,2), strides=(2,2), activation='relu'))(x)
+    x = keras.layers.TimeDistributed(keras.layers.Flatten())(x)
+    convFeatures  = keras.layers.TimeDistributed(keras.layers.Dropout(rate=0.5))(x)
+    frameFeatures = keras.layers.TimeDistributed(keras.layers.Dense(units=64, activation='linear'))(convFeatures)
+
+    return imageInput, convFeatures, frameFeatures
+
+
+def multiHead(seqLen, channelOrder):
+    '''
+    Conv head plus the GPS direction input, concatenated per frame
+    '''
+    from tensorflow import keras
+
+    imageInput, _, frameFeatures = convHead(seqLen, channelOrder)
+    imageFeatures = keras.layers.Dense(units=48, activation="linear")(frameFeatures)
+
+    gpsInput    = keras.Input(shape = (seqLen, 3))
+    gpsFeatures = keras.layers.Dense(units=16, activation='linear')(gpsInput)
+
+    multiFeatures = keras.layers.concatenate([imageFeatures, gpsFeatures])
+    return imageInput, gpsInput, multiFeatures
+
+
+def buildNcpModel(seqLen, rnnSize, channelOrder):
+    from tensorflow import keras
+
+    imageInput, _, frameFeatures = convHead(seqLen, channelOrder)
+    ncpOutput = keras.layers.RNN(ncpCell(), return_sequences=True)(frameFeatures)
+    return keras.models.Model(imageInput, ncpOutput)
+
+
+def buildNcpMultiModel(seqLen, rnnSize, channelOrder):
+    from tensorflow import keras
+
+    imageInput, gpsInput, multiFeatures = multiHead(seqLen, channelOrder)
+    rnn, state = keras.layers.RNN(ncpCell(), return_state=True)(multiFeatures)
+    return keras.models.Model(inputs=[imageInput, gpsInput], outputs = [rnn])
+
+
+def buildCnnModel(seqLen, rnnSize, channelOrder):
+    from tensorflow import keras
+
+    # Revision 2: 1000 and 100 units to 500 and 50 units
+    imageInput, convFeatures, _ = convHead(seqLen, channelOrder)
+    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dense(units=250, activation='relu'))(convFeatures)
+    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dropout(rate=0.5))(cnnOutput)
+    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dense(units=25, activation='relu'))(cnnOutput)
+    cnnOutput = keras.layers.TimeDistributed(keras.layers.Dropout(rate=0.3))(cnnOutput)
+    cnnOutput = keras.layers.Dense(units=3, activation='linear')(cnnOutput)
+    return keras.models.Model(imageInput, cnnOutput)
+
+
+def buildRecurrentModel(modelName, seqLen, rnnSize, channelOrder):
+    from tensorflow import keras
+
+    imageInput, _, frameFeatures = convHead(seqLen, channelOrder)
+    rnnOutput = recurrentLayer(modelName, rnnSize)(frameFeatures)
+    rnnOutput = keras.layers.Dense(units=3, activation='linear')(rnnOutput)
+    return keras.models.Model(imageInput, rnnOutput)
+
+
+def buildRecurrentMultiModel(modelName, seqLen, rnnSize, channelOrder):
+    from tensorflow import keras
+
+    imageInput, gpsInput, multiFeatures = multiHead(seqLen, channelOrder)
+    rnnOutput = recurrentLayer(modelName, rnnSize)(multiFeatures)
+    rnnOutput = keras.layers.Dense(units=3, activation='linear')(rnnOutput)
+    return keras.models.Model(inputs=[imageInput, gpsInput], outputs=[rnnOutput])
+
+
+# (model name, takes gps input) -> builder(seqLen, rnnSize, channelOrder)
+# TODO(cvorbach) Not sure if a multiple input cnn makes sense?
+MODEL_BUILDERS = {
+    ('ncp', False): buildNcpModel,
+    ('ncp', True):  buildNcpMultiModel,
+    ('cnn', False): buildCnnModel,
+}
+
+for name in RECURRENT_MODELS:
+    MODEL_BUILDERS[(name, False)] = lambda seqLen, rnnSize, channelOrder, name=name: buildRecurrentModel(name, seqLen, rnnSize, channelOrder)
+    MODEL_BUILDERS[(name, True)]  = lambda seqLen, rnnSize, channelOrder, name=name: buildRecurrentMultiModel(name, seqLen, rnnSize, channelOrder)
+
+
+def modelNameFromWeights(weightsPath):
+    '''
+    Checkpoints are named <model name>-<timestamp>-weights...
+    '''
+    weightsFile = weightsPath.replace('\\', '/').split('/')[-1]
+    return weightsFile[:weightsFile.index('-')]
+
+
+def buildModel(modelName, multi=False, seqLen=64, rnnSize=32, channelOrder=ChannelOrder.RGB):
+    '''
+    Builds only the requested architecture, taking uint8 images in channelOrder
+    '''
+    if (modelName, multi) not in MODEL_BUILDERS:
+        raise ValueError(f"Unsupported model type: {modelName}")
+
+    return MODEL_BUILDERS[(modelName, multi)](seqLen, rnnSize, channelOrder)
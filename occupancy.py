@@ -0,0 +1,439 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+import threading
+import numpy as np
+from collections import OrderedDict
+from scipy.spatial import cKDTree
+
+# Offsets of the 3x3x3 block of voxels around (and including) a voxel
+ADJACENT_OFFSETS = np.array([(dx, dy, dz) for dz in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)], dtype=np.int64)
+
+
+def distance(p1, p2):
+    return np.linalg.norm(p2 - p1)
+
+
+def packRows(indices):
+    '''
+    Packs (N,3) integer arrays with |index| < 2**20 into scalar int64 keys
+    '''
+    return ((indices[:, 0] + (1 << 20)) << 42) | ((indices[:, 1] + (1 << 20)) << 21) | (indices[:, 2] + (1 << 20))
+
+
+def unpackRows(keys):
+    return np.stack([
+        (keys >> 42) - (1 << 20),
+        ((keys >> 21) & ((1 << 21) - 1)) - (1 << 20),
+        (keys & ((1 << 21) - 1)) - (1 << 20),
+    ], axis=1)
+
+
+def uniqueRows(indices):
+    '''
+    np.unique(indices, axis=0) for integer voxel indices, done on packed
+    scalar keys which is much faster than a row-wise unique
+    '''
+    return unpackRows(np.unique(packRows(indices)))
+
+
+class LRUCache:
+    def __init__(self, capacity: int):
+        self.cache = OrderedDict()
+        self.capacity = capacity
+
+    def __contains__(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key) # Move to front of LRU cache
+            return True
+        return False
+
+    def add(self, key, value=None):
+        '''
+        Returns the evicted (key, value) item if adding key overflowed the cache
+        '''
+        self.cache[key] = value         # Voxel sets don't care about the dict's value, just its set of keys
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.capacity:
+            return self.cache.popitem(last=False)
+        return None
+
+    def get(self, key, default=None):
+        value = self.cache.get(key, default)
+        if value is not default:
+            self.cache.move_to_end(key)
+        return value
+
+    def discard(self, key):
+        self.cache.pop(key, None)
+
+    def keys(self):
+        return list(self.cache.keys())
+
+    def items(self):
+        return list(self.cache.items())
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class VoxelOccupancyCache:
+    '''
+    Occupancy map over integer voxel indices stored in fixed size cubic
+    chunks of chunkSize^3 voxels, one byte per voxel. Chunks live in an
+    LRUCache keyed by integer chunk coordinates so eviction happens a chunk
+    at a time and capacity counts chunks, not voxels.
+
+    Voxels are still exposed as tuples of world coordinates (multiples of
+    voxelSize) through point2Voxel, getAdjacentVoxels and getNextSteps.
+    '''
+
+    def __init__(self, voxelSize: float, capacity: int, endpointTolerance: float = 0.0, chunkSize: int = 16):
+        if chunkSize & (chunkSize - 1) != 0:
+            raise ValueError('Chunk size must be a power of 2')
+
+        self.voxelSize         = voxelSize
+        self.endpointTolerance = endpointTolerance
+        self.chunkSize         = chunkSize
+        self.chunkShift        = chunkSize.bit_length() - 1
+        self.chunkMask         = chunkSize - 1
+        self.chunks            = LRUCache(capacity)
+        self.changes           = None
+        self.changesLock       = threading.Lock() # planners pop changes from their own thread
+        self.index             = None
+
+    def trackChanges(self):
+        '''
+        Start logging the indices of voxels whose occupancy changes, for
+        planners that repair their search to consume with popChanges
+        '''
+        with self.changesLock:
+            self.changes = []
+
+    def logChanges(self, indices):
+        with self.changesLock:
+            if self.changes is not None:
+                self.changes.append(indices)
+
+    def popChanges(self):
+        '''
+        Returns the (N,3) indices of voxels that changed since the last call
+        '''
+        with self.changesLock:
+            if not self.changes:
+                return np.empty((0, 3), dtype=np.int64)
+
+            changes, self.changes = self.changes, []
+
+        return np.concatenate(changes)
+
+    def getChunk(self, chunkKey):
+        chunk = self.chunks.get(chunkKey)
+        if chunk is None:
+            chunk   = bytearray(self.chunkSize**3)
+            evicted = self.chunks.add(chunkKey, chunk)
+
+            # evicted voxels become free
+            if evicted is not None and self.changes is not None:
+                evictedKey, evictedChunk = evicted
+                size  = self.chunkSize
+                local = np.argwhere(np.frombuffer(evictedChunk, dtype=np.uint8).reshape(size, size, size))
+                self.logChanges(local + size * np.array(evictedKey))
+
+            if evicted is not None and self.index is not None:
+                self.index.evict(evicted[1].count(1))
+
+        return chunk
+
+    def addPoint(self, point):
+        self.addPoints(np.array([point]))
+
+    def addPoints(self, points):
+        '''
+        Bulk version of addPoint for an (N,3) point cloud.
+
+        Voxelizes every point at once, dilates the unique voxels by their
+        3x3x3 neighborhood and writes each touched chunk once.
+        '''
+        points = np.asarray(points)
+        if points.size == 0:
+            return
+
+        points = np.reshape(points, (-1, 3))
+
+        # same rounding as point2Voxel (round half to even), done in the points' dtype
+        indices = uniqueRows(np.rint(points / self.voxelSize).astype(np.int64))
+        indices = uniqueRows((indices[:, np.newaxis, :] + ADJACENT_OFFSETS[np.newaxis, :, :]).reshape(-1, 3))
+
+        self.setIndices(indices)
+
+    def setIndices(self, indices):
+        chunkIndices = indices >> self.chunkShift
+        local        = indices & self.chunkMask
+        flat         = (local[:, 0] * self.chunkSize + local[:, 1]) * self.chunkSize + local[:, 2]
+
+        # group the voxels by chunk
+        chunkKeys, inverse = np.unique(packRows(chunkIndices), return_inverse=True)
+        order  = np.argsort(inverse, kind='stable')
+        splits = np.cumsum(np.bincount(inverse, minlength=len(chunkKeys)))[:-1]
+
+        groups = zip(map(tuple, unpackRows(chunkKeys).tolist()), np.split(flat[order], splits), np.split(indices[order], splits))
+        for chunkKey, group, groupIndices in groups:
+            chunk   = np.frombuffer(self.getChunk(chunkKey), dtype=np.uint8)
+            isFresh = chunk[group] == 0
+
+            # log after writing so a planner never reads a change before it lands
+            chunk[group] = 1
+            if self.changes is not None:
+                self.logChanges(groupIndices[isFresh])
+            if self.index is not None:
+                self.index.add(groupIndices[isFresh])
+
+    def isOccupiedIndex(self, i, j, k):
+        chunk = self.chunks.get((i >> self.chunkShift, j >> self.chunkShift, k >> self.chunkShift))
+        if chunk is None:
+            return False
+
+        size = self.chunkSize
+        mask = self.chunkMask
+        return chunk[((i & mask) * size + (j & mask)) * size + (k & mask)] != 0
+
+    def indexLookup(self):
+        '''
+        Returns a fast isOccupiedIndex for a single query burst such as one
+        path search. Chunks are looked up (and touched in the LRU) once each;
+        chunks created after the first query of a chunk are not seen.
+        '''
+        chunks = self.chunks
+        shift  = self.chunkShift
+        mask   = self.chunkMask
+        size   = self.chunkSize
+        seen   = dict()
+
+        def isOccupied(i, j, k):
+            key = (i >> shift, j >> shift, k >> shift)
+            try:
+                chunk = seen[key]
+            except KeyError:
+                chunk = seen[key] = chunks.get(key)
+
+            return chunk is not None and chunk[((i & mask) * size + (j & mask)) * size + (k & mask)] != 0
+
+        return isOccupied
+
+    def __contains__(self, point):
+        voxelSize = self.voxelSize
+        return self.isOccupiedIndex(int(round(point[0] / voxelSize)), int(round(point[1] / voxelSize)), int(round(point[2] / voxelSize)))
+
+    def containsPoints(self, points):
+        '''
+        Bulk version of __contains__, returns whether each of the (N,3)
+        points is in an occupied voxel
+        '''
+        return self.containsIndices(np.rint(np.reshape(points, (-1, 3)) / self.voxelSize).astype(np.int64))
+
+    def containsIndices(self, indices):
+        local   = indices & self.chunkMask
+        flat    = (local[:, 0] * self.chunkSize + local[:, 1]) * self.chunkSize + local[:, 2]
+
+        # copy each chunk the points touch into a table, missing chunks are free
+        chunkKeys, inverse = np.unique(packRows(indices >> self.chunkShift), return_inverse=True)
+        table = np.zeros((len(chunkKeys), self.chunkSize**3), dtype=np.uint8)
+        for n, chunkKey in enumerate(map(tuple, unpackRows(chunkKeys).tolist())):
+            chunk = self.chunks.get(chunkKey)
+            if chunk is not None:
+                table[n] = np.frombuffer(chunk, dtype=np.uint8)
+
+        return table[inverse.reshape(-1), flat] != 0
+
+    def point2Index(self, point):
+        return tuple(int(round(v / self.voxelSize)) for v in point)
+
+    def point2Voxel(self, point):
+        return tuple(self.voxelSize * int(round(v / self.voxelSize)) for v in point)
+
+    def getAdjacentVoxels(self, voxel):
+        voxelSize = self.voxelSize
+        return [(voxel[0] + voxelSize*dx, voxel[1] + voxelSize*dy, voxel[2] + voxelSize*dz) for dx, dy, dz in ADJACENT_OFFSETS.tolist()]
+
+    def getNextSteps(self, voxel, endpoint):
+        neighbors = []
+        possibleNeighbors = self.getAdjacentVoxels(voxel)
+
+        for v in possibleNeighbors:
+            if v not in self or distance(np.array(v), np.array(endpoint)) < self.endpointTolerance:
+                neighbors.append(v)
+
+        return neighbors
+
+    def occupiedIndices(self):
+        '''
+        Returns the (N,3) indices of every occupied voxel
+        '''
+        size    = self.chunkSize
+        indices = [np.empty((0, 3), dtype=np.int64)]
+        for chunkKey, chunk in self.chunks.items():
+            local = np.argwhere(np.frombuffer(chunk, dtype=np.uint8).reshape(size, size, size))
+            indices.append(local + size * np.array(chunkKey))
+        return np.concatenate(indices)
+
+    def occupiedVoxels(self):
+        '''
+        Returns the (N,3) world coordinates of every occupied voxel
+        '''
+        return self.voxelSize * self.occupiedIndices()
+
+    def spatialIndex(self):
+        '''
+        Returns an OccupancyIndex over the map, built on first use and kept
+        up to date as voxels are added and evicted
+        '''
+        if self.index is None:
+            self.index = OccupancyIndex(self)
+        return self.index
+
+    def __len__(self):
+        return sum(chunk.count(1) for chunk in self.chunks.cache.values())
+
+    def plotOccupancies(self, client, duration):
+        from airsim import Vector3r
+
+        occupiedPoints = [Vector3r(*v) for v in self.occupiedVoxels().tolist()]
+        client.simPlotPoints(occupiedPoints, color_rgba = [0.0, 0.0, 1.0, 1.0], duration=duration)
+
+
+class OccupancyIndex:
+    '''
+    Nearest neighbor and radius queries over the occupied voxels of a
+    VoxelOccupancyCache, in world coordinates.
+
+    The voxels are held in a cKDTree rebuilt from the whole map only once
+    the voxels added since, or evicted since, outnumber rebuildFraction of
+    the tree. Voxels added in between go in a small delta tree rebuilt
+    when it's next queried. Evicted voxels stay in the trees until the next
+    rebuild, so every candidate is checked against the map before it is
+    returned.
+    '''
+    def __init__(self, occupancyMap, rebuildFraction=0.25, minRebuildSize=4096):
+        self.map             = occupancyMap
+        self.rebuildFraction = rebuildFraction
+        self.minRebuildSize  = minRebuildSize
+        self.rebuilds        = 0
+        self.rebuild()
+
+    def rebuild(self):
+        self.indices    = self.map.occupiedIndices()
+        self.tree       = cKDTree(self.map.voxelSize * self.indices)
+        self.added      = []
+        self.delta      = np.empty((0, 3), dtype=np.int64)
+        self.deltaTree  = None
+        self.staleCount = 0
+        self.rebuilds  += 1
+
+    def add(self, indices):
+        if len(indices) > 0:
+            self.added.append(indices)
+
+    def evict(self, count):
+        self.staleCount += count
+
+    def update(self):
+        '''
+        Folds voxels added since the last query into the delta tree, or
+        rebuilds everything if enough has changed
+        '''
+        if self.added:
+            self.delta     = np.concatenate([self.delta] + self.added)
+            self.added     = []
+            self.deltaTree = None
+
+        if len(self.delta) + self.staleCount > max(self.minRebuildSize, self.rebuildFraction * len(self.indices)):
+            self.rebuild()
+        if self.deltaTree is None:
+            self.deltaTree = cKDTree(self.map.voxelSize * self.delta)
+
+        return [(self.tree, self.indices), (self.deltaTree, self.delta)]
+
+    def merge(self, indices, distances):
+        '''
+        Joins the results from both trees, dropping evicted voxels and the
+        second copy of voxels added back after being evicted
+        '''
+        indices   = np.concatenate(indices)
+        distances = np.concatenate(distances)
+
+        # without evictions since the rebuild every voxel in the trees is occupied and in just one
+        if self.staleCount > 0:
+            isOccupied = self.map.containsIndices(indices)
+            _, first   = np.unique(packRows(indices[isOccupied]), return_index=True)
+            indices    = indices[isOccupied][first]
+            distances  = distances[isOccupied][first]
+
+        return indices, distances
+
+    def nearest(self, point, k=1):
+        '''
+        Returns the distances to and world coordinates of the k occupied
+        voxels nearest point, nearest first. There are fewer if the map has
+        fewer than k.
+        '''
+        point = np.asarray(point, dtype=float)
+
+        indices, distances = [], []
+        for tree, treeIndices in self.update():
+            n = len(treeIndices)
+            queryK = k
+            while True:
+                d, i = tree.query(point, k=min(queryK, max(n, 1)))
+                d, i = np.atleast_1d(d), np.atleast_1d(i)
+                found = i < n
+                d, i  = d[found], treeIndices[i[found]]
+
+                # query deeper until enough of the candidates are still in the map
+                if queryK >= n or self.staleCount == 0 or np.count_nonzero(self.map.containsIndices(i)) >= k:
+                    break
+                queryK *= 2
+
+            indices.append(i)
+            distances.append(d)
+
+        indices, distances = self.merge(indices, distances)
+        order = np.argsort(distances, kind='stable')[:k]
+        return distances[order], self.map.voxelSize * indices[order]
+
+    def withinRadius(self, point, radius, p=2):
+        '''
+        Returns the world coordinates of the occupied voxels within radius
+        of point under the p-norm, in no particular order
+        '''
+        point = np.asarray(point, dtype=float)
+
+        indices = []
+        for tree, treeIndices in self.update():
+            indices.append(treeIndices[np.array(tree.query_ball_point(point, radius, p=p), dtype=np.int64)])
+
+        indices, _ = self.merge(indices, [np.empty(len(i)) for i in indices])
+        return self.map.voxelSize * indices
+
+    def clearance(self, points):
+        '''
+        Returns the distance from each of the (N,3) points to the nearest
+        occupied voxel, inf if the map is empty
+        '''
+        points    = np.reshape(points, (-1, 3)).astype(float)
+        clearance = np.full(len(points), np.inf)
+        isStale   = np.zeros(len(points), dtype=bool)
+
+        for tree, treeIndices in self.update():
+            if len(treeIndices) == 0:
+                continue
+
+            d, i       = tree.query(points)
+            isOccupied = self.map.containsIndices(treeIndices[i]) if self.staleCount > 0 else np.ones(len(points), dtype=bool)
+            isStale   |= ~isOccupied
+            clearance  = np.minimum(clearance, np.where(isOccupied, d, np.inf))
+
+        # an evicted voxel hid the nearest occupied one, query deeper
+        for row in np.flatnonzero(isStale):
+            distances, _ = self.nearest(points[row])
+            clearance[row] = distances[0] if len(distances) > 0 else np.inf
+
+        return clearance
@@ -0,0 +1,126 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+Pipelined stages for the model flown control loop.
+
+Frame capture and command dispatch each run on their own thread, joined
+to the control loop by single slot queues that drop stale items. Capture
+of the next frame then overlaps inference on the current one and dispatch
+of the previous command, and the control loop only ever sees the newest
+frame, which bounds latency. Capture is paced by the control loop: the
+next frame is only captured once the loop takes the last one, so the
+simulator isn't polled for frames that would be dropped.
+'''
+import queue
+import threading
+
+
+class LatestQueue:
+    '''
+    Bounded queue that drops its oldest item instead of blocking the producer
+    '''
+    def __init__(self, maxsize=1):
+        self.queue   = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout=timeout)
+
+
+class Stage(threading.Thread):
+    '''
+    Daemon thread calling work until stopped. An exception stops the stage
+    and is kept to be raised on the control loop's thread.
+    '''
+    def __init__(self, name, work):
+        super().__init__(name=name, daemon=True)
+        self.work    = work
+        self.stopped = threading.Event()
+        self.error   = None
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                self.work()
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self.stopped.set()
+
+
+class FlightPipeline:
+    '''
+    capture() is called repeatedly on its own thread and command(item) on
+    another for the newest item sent. Each should use its own simulator
+    client since rpc clients aren't thread safe.
+    '''
+    def __init__(self, capture, command, timeout=1.0):
+        self.command  = command
+        self.timeout  = timeout
+        self.capture  = capture
+        self.frames   = LatestQueue(1)
+        self.commands = LatestQueue(1)
+        self.wanted   = threading.Event() # set when the control loop has taken the last frame
+        self.wanted.set()
+
+        self.captureStage = Stage('capture', self.captureWhenWanted)
+        self.commandStage = Stage('command', self.dispatch)
+
+    def captureWhenWanted(self):
+        if not self.wanted.wait(timeout=self.timeout):
+            return
+        self.wanted.clear()
+        self.frames.put(self.capture())
+
+    def dispatch(self):
+        try:
+            item = self.commands.get(timeout=self.timeout)
+        except queue.Empty:
+            return
+        self.command(item)
+
+    def start(self):
+        self.captureStage.start()
+        self.commandStage.start()
+        return self
+
+    def stop(self):
+        for stage in (self.captureStage, self.commandStage):
+            stage.stop()
+        for stage in (self.captureStage, self.commandStage):
+            stage.join(timeout=self.timeout)
+
+    def check(self):
+        for stage in (self.captureStage, self.commandStage):
+            if stage.error is not None:
+                raise stage.error
+
+    def latest(self):
+        '''
+        Blocks for the newest captured frame and starts capturing the next
+        '''
+        while True:
+            self.check()
+            try:
+                frame = self.frames.get(timeout=self.timeout)
+            except queue.Empty:
+                continue
+
+            self.wanted.set()
+            return frame
+
+    def send(self, item):
+        self.check()
+        self.commands.put(item)
@@ -0,0 +1,351 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+import heapq
+import math
+import time
+
+from occupancy import ADJACENT_OFFSETS
+
+# 26-connected neighborhood in integer voxel indices and the length of each step in voxels
+NEIGHBOR_OFFSETS = [tuple(offset) for offset in ADJACENT_OFFSETS.tolist() if any(offset)]
+NEIGHBOR_STEPS   = [(dx, dy, dz, math.sqrt(dx*dx + dy*dy + dz*dz)) for dx, dy, dz in NEIGHBOR_OFFSETS]
+
+INFINITY = float('inf')
+
+
+# A* Path finding
+def findPath(startpoint, endpoint, occupancyMap, heuristicWeight=100, stats=None):
+    '''
+    A* over the 26-connected integer voxel grid of occupancyMap.
+
+    Voxels within the map's endpoint tolerance of the end voxel are always
+    traversable. The heuristic is heuristicWeight times the euclidean distance
+    to the endpoint in world coordinates. Stale heap entries are skipped
+    lazily; closed voxels are only reopened if a cheaper route to them turns
+    up, which the inflated heuristic allows.
+
+    Returns the path as a list of voxels in world coordinates.
+    '''
+    voxelSize  = occupancyMap.voxelSize
+    isOccupied = occupancyMap.indexLookup()
+    sqrt       = math.sqrt
+    push       = heapq.heappush
+    xEnd, yEnd, zEnd = (float(v) for v in endpoint)
+
+    def h(i, j, k):
+        dx = voxelSize * i - xEnd
+        dy = voxelSize * j - yEnd
+        dz = voxelSize * k - zEnd
+        return heuristicWeight * sqrt(dx*dx + dy*dy + dz*dz)
+
+    start = occupancyMap.point2Index(startpoint)
+    end   = occupancyMap.point2Index((xEnd, yEnd, zEnd))
+
+    # compare squared distances in voxels against the tolerance
+    toleranceSquared = (occupancyMap.endpointTolerance / voxelSize)**2
+    ei, ej, ek = end
+
+    cameFrom = dict()
+    gScore   = {start: 0}
+    closed   = set()
+    getG     = gScore.get
+    steps    = [(dx, dy, dz, voxelSize * step, voxelSize * dx, voxelSize * dy, voxelSize * dz) for dx, dy, dz, step in NEIGHBOR_STEPS]
+
+    openSet = [(h(*start), start)]
+    expansions = 0
+
+    while openSet:
+        current = heapq.heappop(openSet)[1]
+
+        # lazy deletion of entries superseded by a cheaper push
+        if current in closed:
+            continue
+        closed.add(current)
+        expansions += 1
+
+        if current == end:
+            path = [current]
+            while path[-1] != start:
+                path.append(cameFrom[path[-1]])
+
+            if stats is not None:
+                stats['expansions'] = expansions
+
+            return [tuple(voxelSize * v for v in voxel) for voxel in reversed(path)]
+
+        ci, cj, ck = current
+        currentG   = gScore[current]
+
+        # displacement from the endpoint in world coordinates
+        cx = voxelSize * ci - xEnd
+        cy = voxelSize * cj - yEnd
+        cz = voxelSize * ck - zEnd
+
+        for dx, dy, dz, step, sx, sy, sz in steps:
+            i, j, k  = ci + dx, cj + dy, ck + dz
+            neighbor = (i, j, k)
+
+            tentativeGScore = currentG + step
+            if tentativeGScore >= getG(neighbor, INFINITY):
+                continue
+
+            # occupied voxels never get a gScore, so only improvements need the occupancy lookup
+            if isOccupied(i, j, k) and (i - ei)**2 + (j - ej)**2 + (k - ek)**2 >= toleranceSquared:
+                continue
+
+            cameFrom[neighbor] = current
+            gScore[neighbor]   = tentativeGScore
+            closed.discard(neighbor)
+
+            hx = cx + sx
+            hy = cy + sy
+            hz = cz + sz
+            push(openSet, (tentativeGScore + heuristicWeight * sqrt(hx*hx + hy*hy + hz*hz), neighbor))
+
+    if stats is not None:
+        stats['expansions'] = expansions
+
+    raise ValueError("Couldn't find a path")
+
+
+SQRT2 = math.sqrt(2)
+SQRT3 = math.sqrt(3)
+
+def gridDistance(a, b):
+    '''
+    Length of the shortest obstacle free 26-connected path between two voxel
+    indices, a consistent heuristic for searches on the voxel grid
+    '''
+    dx, dy, dz = abs(a[0] - b[0]), abs(a[1] - b[1]), abs(a[2] - b[2])
+    low  = min(dx, dy, dz)
+    high = max(dx, dy, dz)
+    mid  = dx + dy + dz - low - high
+    return SQRT3*low + SQRT2*(mid - low) + (high - mid)
+
+
+class AnytimePlanner:
+    '''
+    ARA* (Likhachev, Gordon & Thrun, 2003) over the 26-connected voxel grid.
+
+    Weighted A* with an inflation factor epsilon that is lowered every time
+    a solution is found, reusing the previous search in between. Each call
+    to plan gets a time and expansion budget and returns the best path found
+    so far with its suboptimality bound, so planning never overruns a tick
+    and keeps improving the path on later ticks.
+
+    The search runs backwards from the end voxel,
+    so its g-values stay valid when the drone moves and only the open list
+    has to be re-keyed. New occupancy inside the searched region only
+    invalidates the voxels whose path to the end led through it, and the
+    search reopens around them. Epsilon keeps falling unless the current
+    path is blocked, when it goes back to the initial epsilon as in Anytime
+    D* to find a new path quickly from the repaired g-values.
+    '''
+
+    def __init__(self, endpoint, occupancyMap, initialEpsilon=5.0, epsilonStep=1.0):
+        self.occupancyMap   = occupancyMap
+        self.voxelSize      = occupancyMap.voxelSize
+        self.initialEpsilon = initialEpsilon
+        self.epsilonStep    = epsilonStep
+
+        self.goal             = occupancyMap.point2Index(endpoint)
+        self.toleranceSquared = (occupancyMap.endpointTolerance / self.voxelSize)**2
+
+        self.epsilon   = initialEpsilon
+        self.g         = {self.goal: 0.0}
+        self.successor = dict()
+        self.closed    = set()
+        self.incons    = set()
+        self.openSet   = []
+        self.openKeys  = dict()
+        self.converged = False
+
+        self.start      = None
+        self.path       = None
+        self.bound      = INFINITY
+        self.expansions = 0
+
+        occupancyMap.trackChanges()
+
+    def isBlocked(self, voxel):
+        i, j, k    = voxel
+        ei, ej, ek = self.goal
+        return self.occupancyMap.isOccupiedIndex(i, j, k) and (i - ei)**2 + (j - ej)**2 + (k - ek)**2 >= self.toleranceSquared
+
+    def key(self, voxel):
+        return self.g[voxel] + self.epsilon * self.voxelSize * gridDistance(self.start, voxel)
+
+    def push(self, voxel):
+        key = self.key(voxel)
+        self.openKeys[voxel] = key
+        heapq.heappush(self.openSet, (key, voxel))
+
+    def rekey(self):
+        '''
+        Rebuilds the open list for a new start or epsilon, folding in INCONS
+        '''
+        voxels = set(self.openKeys) | self.incons
+        self.openKeys = {voxel: self.key(voxel) for voxel in voxels}
+        self.openSet  = [(key, voxel) for voxel, key in self.openKeys.items()]
+        heapq.heapify(self.openSet)
+        self.incons   = set()
+
+    def improvePath(self, deadline, maxExpansions):
+        '''
+        Runs weighted A* until the start is settled at the current epsilon.
+        Returns False if the budget ran out first.
+        '''
+        g, openSet, openKeys = self.g, self.openSet, self.openKeys
+
+        while openSet:
+            key, u = openSet[0]
+
+            # lazy deletion of entries superseded by a cheaper push
+            if openKeys.get(u) != key:
+                heapq.heappop(openSet)
+                continue
+
+            if g.get(self.start, INFINITY) <= key:
+                return True
+
+            if self.expansions >= maxExpansions or (self.expansions % 64 == 0 and time.monotonic() > deadline):
+                return False
+
+            heapq.heappop(openSet)
+            del openKeys[u]
+            self.closed.add(u)
+            self.expansions += 1
+
+            # moving into a blocked voxel costs infinity
+            if self.isBlocked(u):
+                continue
+
+            i, j, k = u
+            gU      = g[u]
+            for dx, dy, dz, step in NEIGHBOR_STEPS:
+                s    = (i - dx, j - dy, k - dz)
+                cost = gU + self.voxelSize * step
+                if cost < g.get(s, INFINITY):
+                    g[s] = cost
+                    self.successor[s] = u
+
+                    if s in self.closed:
+                        self.incons.add(s)
+                    else:
+                        self.push(s)
+
+        if g.get(self.start, INFINITY) == INFINITY:
+            raise ValueError("Couldn't find a path")
+        return True
+
+    def repair(self, changes):
+        '''
+        Drops the g-values of voxels whose path to the end led through a newly
+        blocked voxel and reopens the voxels around them and any freed ones.
+        Returns whether the search changed.
+        '''
+        g, successor = self.g, self.successor
+
+        blocked, reopen = [], set()
+        for voxel in map(tuple, changes.tolist()):
+            if voxel in g:
+                if self.isBlocked(voxel):
+                    blocked.append(voxel)
+                else:
+                    reopen.add(voxel)
+
+        # a voxel's predecessors are its neighbors, so walk back from the blocked ones
+        invalid = set()
+        while blocked:
+            i, j, k = blocked.pop()
+            for dx, dy, dz, step in NEIGHBOR_STEPS:
+                s = (i - dx, j - dy, k - dz)
+                if s not in invalid and successor.get(s) == (i, j, k):
+                    invalid.add(s)
+                    blocked.append(s)
+
+        for voxel in invalid:
+            del g[voxel]
+            del successor[voxel]
+            self.closed.discard(voxel)
+            self.incons.discard(voxel)
+            self.openKeys.pop(voxel, None)
+
+        # the voxels bordering the invalidated ones search back into them
+        for i, j, k in invalid:
+            for dx, dy, dz, step in NEIGHBOR_STEPS:
+                s = (i + dx, j + dy, k + dz)
+                if s in g:
+                    reopen.add(s)
+
+        for voxel in reopen - invalid:
+            self.closed.discard(voxel)
+            self.incons.discard(voxel)
+            self.push(voxel)
+
+        return bool(invalid or reopen)
+
+    def suboptimalityBound(self):
+        '''
+        The ARA* bound min(epsilon, g(start) / min over OPEN and INCONS of g + h)
+        '''
+        gStart = self.g.get(self.start, INFINITY)
+        if gStart == INFINITY:
+            return INFINITY
+
+        lowerBound = min((self.g[v] + self.voxelSize * gridDistance(self.start, v) for v in set(self.openKeys) | self.incons), default=gStart)
+        return min(self.epsilon, gStart / lowerBound) if lowerBound > 0 else self.epsilon
+
+    def extractPath(self):
+        path = [self.start]
+        while path[-1] != self.goal:
+            path.append(self.successor[path[-1]])
+
+        return [tuple(self.voxelSize * v for v in voxel) for voxel in path]
+
+    def isPathFree(self, path):
+        return path is not None and not any(self.isBlocked(self.occupancyMap.point2Index(v)) for v in path[1:])
+
+    def plan(self, startpoint, timeBudget, maxExpansions=INFINITY):
+        '''
+        Improves the plan from startpoint for at most timeBudget seconds or
+        maxExpansions expansions. Returns the best path found so far (None if
+        there is none yet), its suboptimality bound and the expansions used.
+        '''
+        deadline = time.monotonic() + timeBudget
+        start    = self.occupancyMap.point2Index(startpoint)
+
+        moved      = start != self.start
+        self.start = start
+
+        if self.repair(self.occupancyMap.popChanges()):
+            self.converged = False
+
+            # a blocked path is searched around quickly at the initial epsilon,
+            # reusing the repaired g-values, otherwise epsilon keeps falling
+            if self.path is not None and not self.isPathFree(self.path):
+                self.path, self.bound = None, INFINITY
+                self.epsilon = self.initialEpsilon
+                self.closed  = set()
+                moved        = True
+
+        if moved:
+            self.converged = False
+            if not self.openKeys and not self.incons:
+                self.push(self.goal)
+            self.rekey()
+
+        self.expansions = 0
+        while not self.converged and self.improvePath(deadline, maxExpansions):
+            self.path  = self.extractPath()
+            self.bound = self.suboptimalityBound()
+
+            if self.epsilon <= 1:
+                self.converged = True
+                break
+
+            self.epsilon = max(1.0, self.epsilon - self.epsilonStep)
+            self.closed  = set()
+            self.rekey()
+
+        # a copy like findPath's, callers refill their knot lists from it
+        return (None if self.path is None else list(self.path)), self.bound, self.expansions
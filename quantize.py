@@ -0,0 +1,119 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from models import ChannelOrder, buildModel, modelNameFromWeights, uint8Images
+from inference import InferenceBackend, InferenceMode, StreamingModel, compileModel, splitModel, tfliteFunction
+
+parser = argparse.ArgumentParser(description='Post-training int8 quantization of a flight model conv head')
+parser.add_argument('model_weights', type=str, help='hdf5 checkpoint from training.py')
+parser.add_argument('--data_directory',        type=str,   default=os.getcwd() + '/data/', help='Processed data with a directory of images.npy and vectors.npy per run')
+parser.add_argument('--output',                type=str,   default=None,  help='Where to write the int8 head (default: next to the weights)')
+parser.add_argument('--rnn_size',              type=int,   default=32,    help='Size of the flight model recurrent layer')
+parser.add_argument('--calibration_runs',      type=int,   default=20,    help='Number of runs to calibrate activation ranges on')
+parser.add_argument('--validation_proportion', type=float, default=0.1,   help='Proportion of runs held out to check accuracy on')
+parser.add_argument('--max_loss_increase',     type=float, default=0.01,  help='Refuse to export if held out cosine similarity loss rises by more than this')
+parser.add_argument('--seed',                  type=int,   default=0)
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+# Partition runs into held out and calibration sets
+
+runDirectories = sorted(os.listdir(args.data_directory))
+random.shuffle(runDirectories)
+if len(runDirectories) < 2:
+    raise ValueError("Need at least 2 runs in " + args.data_directory)
+
+k = max(1, int(args.validation_proportion * len(runDirectories)))
+heldOutRuns     = runDirectories[:k]
+calibrationRuns = runDirectories[k:k + args.calibration_runs]
+
+def loadRun(directory):
+    '''
+    Processed images are RGB, the head is quantized for the BGR camera frames it gets in flight
+    '''
+    images  = uint8Images(np.load(args.data_directory + '/' + directory + '/images.npy'))[..., ::-1]
+    vectors = np.load(args.data_directory + '/' + directory + '/vectors.npy')
+    return images, vectors
+
+# Setup the network
+sequenceLength = loadRun(heldOutRuns[0])[0].shape[0]
+modelName      = modelNameFromWeights(args.model_weights)
+
+model = buildModel(modelName, seqLen=sequenceLength, rnnSize=args.rnn_size, channelOrder=ChannelOrder.BGR)
+model.load_weights(args.model_weights)
+head, _, _ = splitModel(model)
+
+# Quantize the per frame head, the recurrent layer stays float
+def representativeFrames():
+    for directory in calibrationRuns:
+        images, _ = loadRun(directory)
+        for image in images:
+            yield [image[np.newaxis, np.newaxis]]
+
+converter = tf.lite.TFLiteConverter.from_keras_model(head)
+converter.optimizations             = [tf.lite.Optimize.DEFAULT]
+converter.representative_dataset    = representativeFrames
+converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+quantizedHead = converter.convert()
+
+quantizedFile = tempfile.NamedTemporaryFile(suffix='.tflite', delete=False)
+quantizedFile.write(quantizedHead)
+quantizedFile.close()
+
+# Accuracy gate on held out runs
+
+def cosineSimilarityLoss(predictions, targets):
+    predictions = predictions / np.maximum(np.linalg.norm(predictions, axis=-1, keepdims=True), 1e-12)
+    targets     = targets / np.maximum(np.linalg.norm(targets, axis=-1, keepdims=True), 1e-12)
+    return -np.mean(np.sum(predictions * targets, axis=-1))
+
+def heldOutLoss(quantizedHeadPath):
+    streamingModel = StreamingModel(model, sequenceLength, mode=InferenceMode.WINDOWED, quantizedHead=quantizedHeadPath)
+
+    losses = []
+    for directory in heldOutRuns:
+        images, vectors = loadRun(directory)
+
+        streamingModel.reset()
+        predictions = np.array([streamingModel.step(image) for image in images])
+        losses.append(cosineSimilarityLoss(predictions, vectors))
+
+    return np.mean(losses)
+
+floatLoss     = heldOutLoss(None)
+quantizedLoss = heldOutLoss(quantizedFile.name)
+
+# Latency of the head per frame
+
+def medianLatency(run, frames):
+    run(frames[0]) # warm up
+    latencies = []
+    for frame in frames:
+        startTime = time.perf_counter()
+        run(frame)
+        latencies.append(time.perf_counter() - startTime)
+    return np.median(latencies)
+
+frames        = loadRun(heldOutRuns[0])[0][:, np.newaxis, np.newaxis]
+floatTime     = medianLatency(compileModel(head, InferenceBackend.TFLITE), frames)
+quantizedTime = medianLatency(tfliteFunction(quantizedHead), frames)
+
+print(f'Held out cosine similarity loss: float {floatLoss:.4f}, int8 {quantizedLoss:.4f} ({quantizedLoss - floatLoss:+.4f})')
+print(f'Head latency per frame: float {1000 * floatTime:.2f} ms, int8 {1000 * quantizedTime:.2f} ms ({floatTime / quantizedTime:.1f}x)')
+
+if quantizedLoss - floatLoss > args.max_loss_increase:
+    os.remove(quantizedFile.name)
+    raise SystemExit(f'Not exporting: loss rose by more than {args.max_loss_increase}')
+
+output = args.output or os.path.splitext(args.model_weights)[0] + '-int8-head.tflite'
+shutil.move(quantizedFile.name, output)
+print('Saved int8 head to: ', output)
@@ -0,0 +1,133 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+Fixed rate scheduling of the control loop.
+
+Ticks start on a grid of time.monotonic deadlines one period apart, so
+the tick rate doesn't drift with planning or rpc latency. Lower priority
+work runs as slack tasks between the end of one tick's work and the next
+deadline, in the order they were added, each only if its estimated run
+time fits in the slack left. A tick that overruns its period coalesces
+the ticks it missed: the next tick starts at once and the schedule picks
+up again at the next deadline on the grid. A slack task deferred maxSkips
+times in a row runs anyway, so overruns can't starve it.
+'''
+import time
+
+import numpy as np
+
+
+class SlackTask:
+    def __init__(self, name, run, interval=0.0, maxSkips=10):
+        self.name     = name
+        self.run      = run
+        self.interval = interval # minimum time between runs
+        self.maxSkips = maxSkips
+        self.estimate = 0.0      # moving average of the run time
+        self.lastRun  = -float('inf')
+        self.skips    = 0
+        self.runs     = 0
+        self.deferred = 0
+        self.forced   = 0
+
+
+class FixedRateScheduler:
+    def __init__(self, period):
+        self.period     = period
+        self.slackTasks = []
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts a new schedule from the next wait
+        '''
+        self.deadline     = None
+        self.startTimes   = []
+        self.lateness     = []
+        self.overruns     = 0
+        self.skippedTicks = 0
+
+    def addSlackTask(self, name, run, interval=0.0, maxSkips=10):
+        self.slackTasks.append(SlackTask(name, run, interval, maxSkips))
+
+    def runSlackTasks(self, deadline):
+        '''
+        Runs every due slack task whose estimated time fits before deadline
+        '''
+        for task in self.slackTasks:
+            now = time.monotonic()
+            if now - task.lastRun < task.interval:
+                continue
+
+            fits = now + task.estimate <= deadline
+            if not fits and task.skips < task.maxSkips:
+                task.skips    += 1
+                task.deferred += 1
+                continue
+
+            if not fits:
+                task.forced += 1
+
+            task.run()
+            finished = time.monotonic()
+
+            task.estimate = finished - now if task.runs == 0 else 0.8 * task.estimate + 0.2 * (finished - now)
+            task.lastRun  = now
+            task.skips    = 0
+            task.runs    += 1
+
+    def wait(self):
+        '''
+        Runs slack tasks and sleeps until the next tick is due. The first
+        wait of a schedule runs every slack task and starts the first tick.
+        '''
+        if self.deadline is None:
+            self.runSlackTasks(float('inf'))
+            self.deadline = time.monotonic()
+        else:
+            self.deadline += self.period
+
+            now = time.monotonic()
+            if now > self.deadline:
+                # coalesce the missed ticks into this one
+                missed = int((now - self.deadline) // self.period)
+                self.overruns     += 1
+                self.skippedTicks += missed
+                self.deadline     += missed * self.period
+                self.runSlackTasks(now) # only tasks deferred too often
+            else:
+                self.runSlackTasks(self.deadline)
+
+                delay = self.deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+        start = time.monotonic()
+        self.startTimes.append(start)
+        self.lateness.append(start - self.deadline)
+
+    def frequency(self):
+        '''
+        Achieved tick rate in Hz
+        '''
+        if len(self.startTimes) < 2:
+            return float('nan')
+        return (len(self.startTimes) - 1) / (self.startTimes[-1] - self.startTimes[0])
+
+    def jitter(self):
+        '''
+        Standard deviation of the time between tick starts
+        '''
+        if len(self.startTimes) < 3:
+            return float('nan')
+        return np.std(np.diff(self.startTimes))
+
+    def printSummary(self):
+        if len(self.startTimes) == 0:
+            return
+
+        p50, p99 = 1000 * np.percentile(self.lateness, [50, 99])
+        print(f'{len(self.startTimes)} ticks at {self.frequency():.2f} Hz for a {1 / self.period:.2f} Hz target, jitter {1000 * self.jitter():.2f} ms')
+        print(f'  start lateness p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {1000 * np.max(self.lateness):.2f} ms')
+        print(f'  {self.overruns} overruns, {self.skippedTicks} ticks skipped')
+        for task in self.slackTasks:
+            print(f'  slack {task.name}: {task.runs} runs ({task.forced} forced), {task.deferred} deferred, ~{1000 * task.estimate:.2f} ms')
@@ -0,0 +1,135 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+import numpy as np
+from scipy.linalg import solve_banded
+
+
+class CubicSpline:
+    def __init__(self, x, y, tol=1e-10):
+        self.x = x
+        self.y = y
+        self.coeff = self.fit(x, y, tol)
+
+    def fit(self, x, y, tol=1e-10):
+        """
+        Interpolate using natural cubic splines.
+
+        y is either (n,) or (n,d) to fit d splines over the same x at once.
+        The second derivative conditions form a strictly diagonally dominant
+        tridiagonal system which is solved in O(n) as a banded matrix.
+
+        Returns coefficients:
+        b, coefficient of x of degree 1
+        c, coefficient of x of degree 2
+        d, coefficient of x of degree 3
+        """
+
+        x = np.array(x, dtype=float)
+        y = np.array(y, dtype=float)
+
+        # check if sorted
+        if np.any(np.diff(x) < 0):
+            idx = np.argsort(x)
+            x = x[idx]
+            y = y[idx]
+
+        self.x = x
+        self.y = y
+
+        size = len(x)
+        if size < 2:
+            raise ValueError('Cubic spline needs at least 2 knots')
+
+        delta_x = np.diff(x)
+        delta_y = np.diff(y, axis=0)
+
+        # broadcast the knot spacing against every column of y
+        h     = delta_x.reshape(-1, *([1] * (y.ndim - 1)))
+        slope = delta_y / h
+
+        # Banded form of Ac = k: upper diagonal, diagonal, lower diagonal
+        A = np.zeros(shape=(3, size))
+        A[1, 0]    = 1
+        A[1, -1]   = 1
+        A[0, 2:]   = delta_x[1:]
+        A[1, 1:-1] = 2*(delta_x[:-1] + delta_x[1:])
+        A[2, :-2]  = delta_x[:-1]
+
+        k = np.zeros_like(y)
+        k[1:-1] = 3*(slope[1:] - slope[:-1])
+
+        # Solves for c in Ac = k
+        c = solve_banded((1, 1), A, k)
+
+        # Solves for d and b
+        d = (c[1:] - c[:-1]) / (3*h)
+        b = slope - (h/3)*(2*c[:-1] + c[1:])
+
+        return b, c, d
+
+    def segment(self, t):
+        '''
+        Returns the segment index and offset into the segment of each t,
+        shaped to broadcast against the coefficients
+        '''
+
+        x = self.x
+        t = np.asarray(t, dtype=float)
+
+        # TODO(cvorbach) allow extrapolation
+        if np.any(t < x[0]) or np.any(t > x[-1]):
+            raise Exception("Can't extrapolate")
+
+        # Index of segment to use
+        idx = np.clip(np.searchsorted(x, t, side='right') - 1, 0, len(x) - 2)
+
+        dx = t - x[idx]
+        dx = dx.reshape(dx.shape + (1,) * (self.y.ndim - 1))
+        return idx, dx
+
+    def __call__(self, t):
+        '''
+        Returns the value of the spline at t in [x[0], x[-1]].
+        An array of m values of t gives an (m,d) array of values.
+        '''
+
+        b, c, d = self.coeff
+        idx, dx = self.segment(t)
+
+        value = self.y[idx] + dx*(b[idx] + dx*(c[idx] + dx*d[idx]))
+        return value
+
+    def ddt(self, t):
+        '''
+        Returns the derivative of the spline at t in [x[0], x[-1]]
+        '''
+
+        b, c, d = self.coeff
+        idx, dx = self.segment(t)
+
+        derivative = b[idx] + dx*(2*c[idx] + 3*d[idx]*dx)
+        return derivative
+
+    def d2dt2(self, t):
+        '''
+        Returns the second derivative of the spline at t in [x[0], x[-1]]
+        '''
+
+        b, c, d = self.coeff
+        idx, dx = self.segment(t)
+
+        secondDerivative = 2*c[idx] + 6*d[idx]*dx
+        return secondDerivative
+
+    def derivatives(self, t):
+        '''
+        Returns the value, derivative and second derivative at t with a single segment lookup
+        '''
+
+        b, c, d = self.coeff
+        idx, dx = self.segment(t)
+        b, c, d = b[idx], c[idx], d[idx]
+
+        value            = self.y[idx] + dx*(b + dx*(c + dx*d))
+        derivative       = b + dx*(2*c + 3*d*dx)
+        secondDerivative = 2*c + 6*d*dx
+        return value, derivative, secondDerivative
@@ -0,0 +1,107 @@
+# drone-flight  Copyright (C) 2020  Charles Vorbach
+'''
+Per stage timing of the control loop.
+
+The loop calls tick() at the top of every iteration and lap(stage) after
+each stage, so a stage's time is the time since the previous lap. A stage
+lapped several times in one tick (e.g. once per vehicle) adds up. A tick
+lasts until its last lap, so time spent waiting for the next tick to be
+due isn't counted against it. Each stage costs one clock read and a dict
+update, and NullLoopTimer, used when timing is off, does nothing at all.
+'''
+import json
+import time
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+class LoopTimer:
+    def __init__(self, period, tracePath=None):
+        self.period = period
+        self.trace  = open(tracePath, 'a') if tracePath is not None else None
+        self.runs   = 0
+        self.clear()
+
+    def clear(self):
+        self.samples   = {}   # stage -> seconds per tick
+        self.ticks     = []
+        self.overruns  = 0
+        self.tickStart = None
+        self.lapStart  = None
+        self.stages    = {}
+
+    def tick(self):
+        '''
+        Ends the last tick, if any, and starts the next
+        '''
+        now = time.perf_counter()
+        if self.tickStart is not None:
+            self.record()
+        self.tickStart = now
+        self.lapStart  = now
+        self.stages    = {}
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.lapStart
+        self.lapStart      = now
+
+    def record(self):
+        duration = self.lapStart - self.tickStart
+        self.ticks.append(duration)
+        if duration > self.period:
+            self.overruns += 1
+
+        for stage, seconds in self.stages.items():
+            self.samples.setdefault(stage, []).append(seconds)
+
+        if self.trace is not None:
+            self.trace.write(json.dumps({'run': self.runs, 'tick': len(self.ticks) - 1, 'start': self.tickStart, 'duration': duration, 'stages': self.stages}) + '\n')
+
+    def endRun(self):
+        '''
+        Ends the last tick and prints a summary of the run's stage times
+        '''
+        if self.tickStart is not None:
+            self.record()
+
+        if len(self.ticks) > 0:
+            self.printSummary()
+
+        if self.trace is not None:
+            self.trace.flush()
+
+        self.runs += 1
+        self.clear()
+
+    def printSummary(self):
+        print(f'{len(self.ticks)} ticks, {self.overruns} over the {1000 * self.period:.0f} ms control period')
+        print(f'  {"stage":14s}' + ''.join(f'{"p" + str(p):>9s}' for p in PERCENTILES) + f'{"max":>9s}{"share":>8s}')
+
+        total = np.sum(self.ticks)
+        for stage, samples in [('tick', self.ticks)] + list(self.samples.items()):
+            ms = 1000 * np.percentile(samples, PERCENTILES)
+            print(f'  {stage:14s}' + ''.join(f'{t:9.2f}' for t in ms) + f'{1000 * np.max(samples):9.2f}{100 * np.sum(samples) / total:7.1f}%')
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+
+
+class NullLoopTimer:
+    '''
+    Stands in for LoopTimer when timing is off
+    '''
+    def tick(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def endRun(self):
+        pass
+
+    def close(self):
+        pass
@@ -8,6 +8,8 @@ import numpy as np
 from tensorflow import keras
 import kerasncp as kncp
 
+from models import uint8Images
+
 TRAIN_LSTM                 = False
 TRAINING_DATA_DIRECTORY    = os.getcwd() + '/data/'
 
@@ -58,12 +60,12 @@ class DataGenerator(keras.utils.Sequence):
         return X, Y
 
     def __load_data(self, directories):
-        X = np.empty((self.batch_size, TRAINING_SEQUENCE_LENGTH, *self.xDims))
+        X = np.empty((self.batch_size, TRAINING_SEQUENCE_LENGTH, *self.xDims), dtype=np.uint8)
         Y = np.empty((self.batch_size, TRAINING_SEQUENCE_LENGTH, *self.yDims))
 
         for i, directory in enumerate(directories):
             try:
-                X[i,] = np.load(TRAINING_DATA_DIRECTORY + directory + '/images.npy')
+                X[i,] = uint8Images(np.load(TRAINING_DATA_DIRECTORY + directory + '/images.npy'))
                 Y[i,] = np.load(TRAINING_DATA_DIRECTORY + directory + '/vectors.npy')
             except Exception as e:
                 print("Failed on directory: ", directory)
@@ -106,7 +108,8 @@ wiring = kncp.wirings.NCP(
 rnnCell = kncp.LTCCell(wiring)
 
 ncpModel = keras.models.Sequential()
-ncpModel.add(keras.Input(shape=(TRAINING_SEQUENCE_LENGTH, *IMAGE_SHAPE)))
+ncpModel.add(keras.Input(shape=(TRAINING_SEQUENCE_LENGTH, *IMAGE_SHAPE), dtype='uint8'))
+ncpModel.add(keras.layers.Rescaling(1 / 255)) # uint8 RGB images to [0, 1]
 ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=24, kernel_size=(5,5), strides=(2,2), activation='relu')))
 ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=36, kernel_size=(5,5), strides=(2,2), activation='relu')))
 ncpModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=48, kernel_size=(3,3), strides=(2,2), activation='relu')))
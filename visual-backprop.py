@@ -49,7 +49,8 @@ strides = [
 ]
 
 fullModel = keras.models.Sequential()
-fullModel.add(keras.Input(shape=(None, *IMAGE_SHAPE)))
+fullModel.add(keras.Input(shape=(None, *IMAGE_SHAPE), dtype='uint8'))
+fullModel.add(keras.layers.Rescaling(1 / 255)) # uint8 RGB images to [0, 1]
 fullModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=24, kernel_size=kernels[0], strides=strides[0], activation='relu')))
 fullModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=36, kernel_size=kernels[1], strides=strides[1], activation='relu')))
 fullModel.add(keras.layers.TimeDistributed(keras.layers.Conv2D(filters=48, kernel_size=kernels[2], strides=strides[2], activation='relu')))
@@ -82,13 +83,13 @@ else:
 # Load weights
 visualizeModel.load_weights(WEIGHTS_PATH)
 
-convolutionalLayers = fullModel.layers[:5]
+convolutionalLayers = fullModel.layers[1:6] # after the rescaling
 
 fullModel.summary()
 
 # Separate the covolutional and dense outputs for individual inspection
-convModel = keras.models.Model(fullModel.input, outputs=[fullModel.layers[4].output])
-denseModel = keras.models.Model(fullModel.input, outputs=[fullModel.layers[11].output])
+convModel = keras.models.Model(fullModel.input, outputs=[fullModel.layers[5].output])
+denseModel = keras.models.Model(fullModel.input, outputs=[fullModel.layers[12].output])
 # rnnModel  = keras.models.Model(fullModel.input, outputs=[keras.])
 
 # Visual saliancy
@@ -112,11 +113,11 @@ layer_names = []
 for layer in fullModel.layers:
     layer_names.append(layer.name)
 
-images = np.zeros((1, SEQUENCE_LENGTH, *IMAGE_SHAPE))
+images = np.zeros((1, SEQUENCE_LENGTH, *IMAGE_SHAPE), dtype=np.uint8)
 for i, imageFile in enumerate(os.listdir(MODEL_RECORDING_DIRECTORY)):
     print("Creating Image: ", i)
     try:
-        image = np.array(PIL.Image.open(MODEL_RECORDING_DIRECTORY + '\\' + imageFile).convert('RGB'), dtype=np.float32) / 255
+        image = np.asarray(PIL.Image.open(MODEL_RECORDING_DIRECTORY + '\\' + imageFile).convert('RGB'))
     except PIL.UnidentifiedImageError:
         print("Image: ", imageFile, " is corrupt.")
 